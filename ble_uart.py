@@ -1,4 +1,6 @@
 import bluetooth
+import struct
+import uasyncio as asyncio
 from ble_advertising import advertising_payload
 from micropython import const
 
@@ -6,6 +8,12 @@ from micropython import const
 IRQ_CENTRAL_CONNECT = const(1)
 IRQ_CENTRAL_DISCONNECT = const(2)
 IRQ_GATTS_WRITE = const(3)
+IRQ_MTU_EXCHANGED = const(21)
+
+DEFAULT_MTU = const(23)
+PREFERRED_MTU = const(247)  # A 540 byte frame of 180 pixels in three writes
+ATT_HEADER = const(3)  # MTU minus the largest notification payload
+TX_RETRY_MS = const(20)  # Wait before retrying a notification the stack refused
 
 FLAG_WRITE = const(0x0008)
 FLAG_NOTIFY = const(0x0010)
@@ -27,17 +35,69 @@ UART_SERVICE = (
 # org.bluetooth.characteristic.gap.appearance.xml
 ADV_APPEARANCE_GENERIC_COMPUTER = const(128)
 
+# Received bytes go into a fixed ring buffer and the IRQ only queues the
+# length of every message framed in it; take() turns the next one into a
+# str (or a tuple for a binary frame) in task context. A text message ends
+# with the write it arrived in; newlines are kept in it, so several commands
+# sent in one write (see BleLedController.parse_batch()) are handled as one
+# batch. A write ending in a backslash is the exception: the backslash is
+# dropped and the message carries on in the next write, which is how a
+# central sends a message longer than its ATT payload.
+# Apart from the bytes object returned by gatts_read(), which MicroPython
+# has no way around, nothing is allocated in the IRQ.
+
+# Binary command frames share the RX characteristic with the text commands.
+# They start with BINARY_MAGIC, which no text command does, arrive as one
+# whole write and come out of take() as the tuple unpacked from BINARY_FRAME:
+# (magic, opcode, mode id, r, g, b, brightness, speed). See
+# BleLedController.parse_frame() for the opcodes.
+BINARY_MAGIC = const(0xA5)
+BINARY_FRAME = "<BBBBBBBH"
+BINARY_FRAME_SIZE = const(9)
+
+# Writes starting with STREAM_MAGIC are pixel stream packets. They bypass the
+# ring and are handed, as they are, to the stream callback when one is set
+# (see led_patterns.Stream), even while a continued text message is pending.
+# A binary frame arriving then discards the pending message, so continued
+# text must not start a write with either magic byte.
+STREAM_MAGIC = const(0xA6)
+
+# write() only appends to a preallocated TX ring and wakes run(), which sends
+# whatever has piled up as notifications of up to MTU - 3 bytes, for the
+# smallest MTU exchanged with any connected central. When the stack is out
+# of notification buffers gatts_notify() raises and the chunk is retried a
+# little later (TX_RETRY_MS), so replies never block command handling. Data
+# that does not fit in the ring is dropped and counted in tx_dropped.
+
 
 class BLEUART:
-    def __init__(self, name, queue, led, rxbuf=100):
+    def __init__(self, name, queue, led, rxbuf=256, txbuf=2048):
         self.ble = bluetooth.BLE()
         self.ble.active(True)
         self.ble.irq(self.ble_irq)
+        self.ble.config(mtu=PREFERRED_MTU)
         ((self.tx_handle, self.rx_handle),) = self.ble.gatts_register_services((UART_SERVICE,))
         # Increase the size of the rx buffer and enable append mode.
-        self.ble.gatts_set_buffer(self.rx_handle, rxbuf, True)
-        self.connections = set()
-        self.rx_buffer = bytearray()
+        self.ble.gatts_set_buffer(self.rx_handle, max(rxbuf, 2 * PREFERRED_MTU), True)
+        self.connections = {}  # conn_handle -> MTU exchanged with that central
+        self.mtu = DEFAULT_MTU  # Smallest MTU of the connections
+        self.rx_ring = bytearray(rxbuf)
+        self.rx_mv = memoryview(self.rx_ring)
+        self.rx_read = 0  # Start of the oldest message not yet taken
+        self.rx_write = 0  # Where the next received byte goes
+        self.rx_start = 0  # Start of the message being received
+        self.rx_overflow = False  # The message being received did not fit
+        self.rx_bytes = 0  # Bytes received
+        self.rx_messages = 0  # Messages framed and queued
+        self.rx_dropped = 0  # Messages lost to a full ring or queue, or malformed
+        self.stream = None  # Called with every pixel stream packet
+        self.tx_ring = bytearray(txbuf)
+        self.tx_mv = memoryview(self.tx_ring)
+        self.tx_read = 0
+        self.tx_write = 0
+        self.tx_flag = asyncio.ThreadSafeFlag()
+        self.tx_dropped = 0  # Bytes that did not fit in the TX ring
+        self.tx_bytes = 0  # Bytes notified, counted once per chunk
         self.queue = queue
         # Optionally add services=[UART_UUID], but this is likely to make the payload too large.
         self.payload = advertising_payload(name=name, appearance=ADV_APPEARANCE_GENERIC_COMPUTER)
@@ -47,46 +107,168 @@ class BLEUART:
     def ble_irq(self, event, data):
         if event == IRQ_CENTRAL_CONNECT:
             conn_handle, _, _ = data
-            self.connections.add(conn_handle)
+            self.connections[conn_handle] = DEFAULT_MTU
+            self.update_mtu()
             self.led.on()
+            try:
+                self.ble.gattc_exchange_mtu(conn_handle)
+            except OSError:
+                pass  # The central keeps the default MTU
         elif event == IRQ_CENTRAL_DISCONNECT:
             conn_handle, _, _ = data
             if conn_handle in self.connections:
-                self.connections.remove(conn_handle)
+                del self.connections[conn_handle]
+            self.update_mtu()
             self.led.off()
+            if not self.connections:
+                self.tx_read = self.tx_write  # Nobody left to send to
+            self.rx_write = self.rx_start  # Drop a half-received message
+            self.rx_overflow = False
             self.advertise()
         elif event == IRQ_GATTS_WRITE:
             conn_handle, value_handle = data
             if conn_handle in self.connections and value_handle == self.rx_handle:
-                self.rx_buffer += self.ble.gatts_read(self.rx_handle)
-            
-                ble_msg = self.read().decode("UTF-8").strip()
-                try:
-                    self.queue.put_sync(ble_msg)
-                except IndexError:
-                    self.write("Queue full, message discarded.")
+                self.receive(self.ble.gatts_read(self.rx_handle))
+        elif event == IRQ_MTU_EXCHANGED:
+            conn_handle, mtu = data
+            if conn_handle in self.connections:
+                self.connections[conn_handle] = mtu
+                self.update_mtu()
+
+    def update_mtu(self):
+        # Notifications go to every central, so they are sized for the one
+        # with the smallest MTU
+        mtu = 0
+        for m in self.connections.values():
+            if not mtu or m < mtu:
+                mtu = m
+        self.mtu = mtu or DEFAULT_MTU
+
+    def receive(self, data):
+        n = len(data)
+        self.rx_bytes += n
+        if n and data[0] == STREAM_MAGIC:
+            if self.stream is not None:
+                self.stream(data)
+            return
+        if n and data[0] == BINARY_MAGIC:
+            if self.rx_start != self.rx_write:
+                self.rx_dropped += 1  # The continued text message
+                self.rx_write = self.rx_start
+            if n != BINARY_FRAME_SIZE:
+                self.rx_dropped += 1
+                return
+            for b in data:
+                self.store(b)
+            self.frame()
+            return
+        more = n and data[n - 1] == 92  # Ends in \, continued in the next write
+        for i in range(n - 1 if more else n):
+            self.store(data[i])
+        if not more:
+            self.frame()
+
+    def store(self, b):
+        size = len(self.rx_ring)
+        w = self.rx_write
+        nxt = w + 1 if w + 1 < size else 0
+        if nxt == self.rx_read:
+            self.rx_overflow = True
+            return
+        self.rx_ring[w] = b
+        self.rx_write = nxt
+
+    def frame(self):
+        # Queue the message received since rx_start, or discard it
+        start = self.rx_start
+        length = (self.rx_write - start) % len(self.rx_ring)
+        if self.rx_overflow:
+            self.rx_overflow = False
+        elif not length:
+            return
+        else:
+            try:
+                self.queue.put_sync(length)
+                self.rx_messages += 1
+                self.rx_start = self.rx_write
+                return
+            except IndexError:
+                pass
+        self.rx_dropped += 1
+        self.rx_write = start
 
     def any(self):
-        return len(self.rx_buffer)
+        # Bytes received and not taken yet
+        return (self.rx_write - self.rx_read) % len(self.rx_ring)
 
-    def read(self, sz=None):
-        if not sz:
-            sz = len(self.rx_buffer)
-        result = self.rx_buffer[0:sz]
-        self.rx_buffer = self.rx_buffer[sz:]
-        return result
+    def take(self, length):
+        # Remove the next queued message from the ring, see the note at the top
+        size = len(self.rx_ring)
+        r = self.rx_read
+        end = r + length
+        if end <= size:
+            data = bytes(self.rx_mv[r:end])
+        else:
+            end -= size
+            data = bytes(self.rx_mv[r:]) + bytes(self.rx_mv[:end])
+        self.rx_read = end if end < size else 0
+        if data[0] == BINARY_MAGIC and length == BINARY_FRAME_SIZE:
+            return struct.unpack_from(BINARY_FRAME, data)
+        try:
+            return data.decode("UTF-8").strip()
+        except UnicodeError:
+            return ""
 
     def write(self, data):
         if self.connections:
-            for conn_handle in self.connections:
-                self.ble.gatts_notify(conn_handle, self.tx_handle, data + "\n")
+            self.put(data.encode() if isinstance(data, str) else data)
+            self.put(b"\n")
+            self.tx_flag.set()
         else:
             print(data)
 
+    def put(self, data):
+        # Append bytes to the TX ring, dropping what does not fit
+        size = len(self.tx_ring)
+        n = len(data)
+        free = size - 1 - (self.tx_write - self.tx_read) % size
+        if n > free:
+            self.tx_dropped += n - free
+            n = free
+        w = self.tx_write
+        first = min(n, size - w)
+        src = memoryview(data)
+        self.tx_mv[w:w + first] = src[:first]
+        if n > first:
+            self.tx_mv[0:n - first] = src[first:n]
+        self.tx_write = (w + n) % size
+
+    async def run(self):
+        # Flush the TX ring, see the note at the top
+        size = len(self.tx_ring)
+        while True:
+            await self.tx_flag.wait()
+            while self.tx_read != self.tx_write:
+                r = self.tx_read
+                end = self.tx_write if self.tx_write > r else size
+                n = min(end - r, self.mtu - ATT_HEADER)
+                chunk = self.tx_mv[r:r + n]
+                try:
+                    for conn_handle in self.connections:
+                        self.ble.gatts_notify(conn_handle, self.tx_handle, chunk)
+                except OSError:
+                    await asyncio.sleep_ms(TX_RETRY_MS)
+                    continue
+                self.tx_bytes += n
+                if self.tx_read == r:  # Not emptied by a disconnect meanwhile
+                    self.tx_read = (r + n) % size
+                await asyncio.sleep_ms(0)
+
     def close(self):
         for conn_handle in self.connections:
             self.ble.gap_disconnect(conn_handle)
         self.connections.clear()
+        self.mtu = DEFAULT_MTU
         
     def advertise(self, interval_us=500000):
         self.ble.gap_advertise(interval_us, adv_data=self.payload)
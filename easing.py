@@ -0,0 +1,93 @@
+# easing.py Fixed-point easing curves for fades, breathing and transitions
+
+# Every curve is a table of STEPS + 1 points of a function rising from 0 to
+# 65535 over x from 0 to ONE; ease() interpolates between the two points
+# around x with integer maths only and returns 0..255, which indexes the
+# colour ramps of palette.py directly. The tables are literals so nothing is
+# computed at import, and neither floats nor math are needed at run time.
+# They were generated with round(f(i / 64) * 65535) for the f given with
+# each.
+
+from array import array
+
+ONE = 4096  # x at the end of a curve
+STEPS = 64  # Intervals per table
+SHIFT = 6  # ONE >> SHIFT == STEPS
+
+# Straight line, for a curve argument that should not curve
+LINEAR = array("H", (
+    0, 1024, 2048, 3072, 4096, 5120, 6144, 7168, 8192,
+    9216, 10240, 11264, 12288, 13312, 14336, 15360, 16384, 17408,
+    18432, 19456, 20480, 21504, 22528, 23552, 24576, 25600, 26624,
+    27648, 28672, 29696, 30720, 31744, 32768, 33791, 34815, 35839,
+    36863, 37887, 38911, 39935, 40959, 41983, 43007, 44031, 45055,
+    46079, 47103, 48127, 49151, 50175, 51199, 52223, 53247, 54271,
+    55295, 56319, 57343, 58367, 59391, 60415, 61439, 62463, 63487,
+    64511, 65535,
+))
+
+# (1 - cos(pi x)) / 2: slow at both ends, the classic breathing curve
+SINE = array("H", (
+    0, 39, 158, 355, 630, 982, 1411, 1915, 2494,
+    3146, 3869, 4662, 5522, 6448, 7438, 8488, 9597, 10762,
+    11980, 13248, 14563, 15922, 17321, 18758, 20228, 21728, 23256,
+    24806, 26375, 27960, 29556, 31160, 32767, 34375, 35979, 37575,
+    39160, 40729, 42279, 43807, 45307, 46777, 48214, 49613, 50972,
+    52287, 53555, 54773, 55938, 57047, 58097, 59087, 60013, 60873,
+    61666, 62389, 63041, 63620, 64124, 64553, 64905, 65180, 65377,
+    65496, 65535,
+))
+
+# x ** 2: eases in
+QUAD = array("H", (
+    0, 16, 64, 144, 256, 400, 576, 784, 1024,
+    1296, 1600, 1936, 2304, 2704, 3136, 3600, 4096, 4624,
+    5184, 5776, 6400, 7056, 7744, 8464, 9216, 10000, 10816,
+    11664, 12544, 13456, 14400, 15376, 16384, 17424, 18496, 19600,
+    20736, 21904, 23104, 24336, 25600, 26896, 28224, 29584, 30976,
+    32400, 33855, 35343, 36863, 38415, 39999, 41615, 43263, 44943,
+    46655, 48399, 50175, 51983, 53823, 55695, 57599, 59535, 61503,
+    63503, 65535,
+))
+
+# x ** 3: eases in harder
+CUBIC = array("H", (
+    0, 0, 2, 7, 16, 31, 54, 86, 128,
+    182, 250, 333, 432, 549, 686, 844, 1024, 1228,
+    1458, 1715, 2000, 2315, 2662, 3042, 3456, 3906, 4394,
+    4921, 5488, 6097, 6750, 7448, 8192, 8984, 9826, 10719,
+    11664, 12663, 13718, 14830, 16000, 17230, 18522, 19876, 21296,
+    22781, 24334, 25955, 27648, 29412, 31250, 33162, 35151, 37219,
+    39365, 41593, 43903, 46298, 48777, 51344, 53999, 56744, 59581,
+    62511, 65535,
+))
+
+# CIE 1931 lightness inverted: even steps of perceived brightness as duty
+CIE = array("H", (
+    0, 113, 227, 340, 453, 567, 686, 821, 972,
+    1141, 1328, 1535, 1762, 2010, 2281, 2575, 2894, 3237,
+    3607, 4004, 4429, 4883, 5367, 5882, 6429, 7009, 7623,
+    8272, 8956, 9677, 10436, 11234, 12071, 12948, 13868, 14830,
+    15835, 16885, 17980, 19121, 20310, 21547, 22833, 24170, 25558,
+    26997, 28490, 30037, 31639, 33297, 35012, 36785, 38616, 40507,
+    42460, 44473, 46550, 48690, 50895, 53166, 55503, 57907, 60380,
+    62922, 65535,
+))
+
+# Curves by the name the curve setting gives them (see settings.CURVE_NAMES)
+CURVES = {"linear": LINEAR, "sine": SINE, "quad": QUAD, "cubic": CUBIC, "cie": CIE}
+
+
+def ease(curve, x):
+    # curve at x, 0 <= x <= ONE, as 0..255
+    if x >= ONE:
+        return curve[STEPS] >> 8
+    i = x >> SHIFT
+    a = curve[i]
+    return (a + ((curve[i + 1] - a) * (x & (ONE // STEPS - 1)) >> SHIFT)) >> 8
+
+
+def triangle(t, period):
+    # x rising from 0 to ONE and falling back over period frames
+    x = (t % period) * 2 * ONE // period
+    return 2 * ONE - x if x > ONE else x
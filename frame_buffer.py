@@ -0,0 +1,121 @@
+# frame_buffer.py Bulk pixel operations on a raw NeoPixel buffer
+
+# Pixels are kept in the strip's native byte order (GRB for WS2812), so a
+# FrameBuffer over np.buf can be latched with np.write() without any Python
+# level reordering. Colours are passed around as packed entries: a bytes-like
+# "table" holding bpp bytes per entry plus an entry index. A single packed
+# colour is simply a one-entry table (see pack()). Whole-buffer passes run
+# through kernels.py, which uses viper code when the firmware supports it.
+# It is imported by the methods that use it: strip.restore() lights the
+# strip at boot with fill() alone, before the viper kernels are compiled.
+
+GRB = (1, 0, 2, 3)
+
+
+class FrameBuffer:
+    def __init__(self, buf, n, bpp=3, order=GRB):
+        self.buf = buf
+        self.mv = memoryview(buf)
+        self.n = n
+        self.bpp = bpp
+        self.order = tuple(order[:bpp])
+        self.size = n * bpp
+        self.black = bytearray(bpp)
+        self.rgb_order = order[0] | order[1] << 2 | order[2] << 4 | bpp << 6  # For kernels.rgb_copy
+        self._scratch = None  # Allocated on first rotate()
+
+    def pack(self, color):
+        # Convert an (r, g, b) tuple into a one-entry table in native order
+        px = bytearray(self.bpp)
+        order = self.order
+        px[order[0]] = color[0]
+        px[order[1]] = color[1]
+        px[order[2]] = color[2]
+        return px
+
+    def _clip(self, start, count):
+        if count is None:
+            count = self.n - start
+        if start < 0:
+            count += start
+            start = 0
+        if start + count > self.n:
+            count = self.n - start
+        return start, count
+
+    def set(self, i, src, index=0):
+        bpp = self.bpp
+        buf = self.buf
+        o = i * bpp
+        s = index * bpp
+        for k in range(bpp):
+            buf[o + k] = src[s + k]
+
+    def fill(self, src, index=0, start=0, count=None):
+        start, count = self._clip(start, count)
+        if count <= 0:
+            return
+        self.set(start, src, index)
+        # Double the filled run with memcpy instead of a per-pixel loop
+        mv = self.mv
+        o = start * self.bpp
+        done = self.bpp
+        total = count * self.bpp
+        while done < total:
+            step = min(done, total - done)
+            mv[o + done:o + done + step] = mv[o:o + step]
+            done += step
+
+    def clear(self):
+        self.fill(self.black)
+
+    def scale(self, factor):
+        # Multiply every channel by factor / 256 (0 clears, 256 keeps)
+        import kernels
+        kernels.scale_buf(self.buf, self.size, factor)
+
+    def add(self, src):
+        # Saturating add of another frame in the same format, to layer one
+        # effect's pixels over another's
+        import kernels
+        kernels.add_sat(self.buf, src, self.size)
+
+    def lookup(self, table, indexes, offset=0, start=0):
+        # Pixel start + i takes table entry (indexes[i] + offset) & 255
+        import kernels
+        kernels.lut_fill(self.mv[start * self.bpp:] if start else self.buf, table, indexes, offset)
+
+    def blit(self, src, start=0, src_start=0, count=None):
+        # Copy count packed pixels from src (a buffer in native order)
+        start, count = self._clip(start, count)
+        if count <= 0:
+            return
+        bpp = self.bpp
+        o = start * bpp
+        s = src_start * bpp
+        self.mv[o:o + count * bpp] = memoryview(src)[s:s + count * bpp]
+
+    def rotate(self, k):
+        # Move every pixel k places towards the end of the strip, wrapping
+        # around; a negative k moves them towards the start
+        k %= self.n
+        if not k:
+            return
+        if self._scratch is None:
+            self._scratch = bytearray(self.size)
+        tmp = self._scratch
+        mv = self.mv
+        size = self.size
+        kb = k * self.bpp
+        tmp[kb:size] = mv[0:size - kb]
+        tmp[0:kb] = mv[size - kb:size]
+        mv[0:size] = tmp
+
+    def put_rgb(self, src, start=0, count=None):
+        # Copy count pixels given as plain r, g, b bytes into native order
+        start, count = self._clip(start, count)
+        if count <= 0:
+            return
+        count = min(count, len(src) // 3)
+        import kernels
+        kernels.rgb_copy(self.mv[start * self.bpp:], src, count, self.rgb_order)
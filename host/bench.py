@@ -0,0 +1,220 @@
+# bench.py Host benchmarks for the effects, the controller and the queue
+#
+# Usage: python host/bench.py [--save] [--tolerance PERCENT]
+#
+# Measures, on the host stand-ins:
+#   render_us.<mode>     mean time to render one frame of every effect
+#   alloc_bytes.<mode>   peak bytes allocated while rendering one frame, less
+#                        the tracing overhead (tracemalloc; CPython's
+#                        allocator, so a guide only)
+#   writes.<mode>        frames out of FRAMES that differ from the one before,
+#                        i.e. the strip writes the scheduler would not skip
+#   latency_us.<mode>    BLE write of a command to the first latch of the new
+#                        effect, through BleLedController and the render task
+#   queue_items_s.sync   ThreadSafeQueue put_sync/get_sync pairs per second
+#   queue_items_s.async  items per second from put_sync to an async for
+# and compares them with the baseline in bench_baseline.json, which --save
+# rewrites. Only alloc_bytes and writes are gated: random is seeded, so they
+# come out the same on every run and machine, and the run exits with status
+# 1 when one is worse than its baseline by more than the tolerance. The
+# timings depend on the machine and its load and are shown next to their
+# baseline for reference only.
+
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from binascii import crc32
+
+import sim
+
+sim.install()
+
+import asyncio  # noqa: E402
+
+BASELINE_FILE = os.path.join(sim.HOST_DIR, "bench_baseline.json")
+FRAMES = 200
+LATENCY_MODES = ("rainbow", "red", "fire", "off", "breathe", "color")
+QUEUE_ITEMS = 20000
+GATED = ("alloc_bytes.", "writes.")
+PARAMS = {"color": (255, 64, 0), "brightness": 80, "speed": 20}
+
+
+def idle(fb, t):
+    pass
+
+
+def peak_alloc(render, fb):
+    # Peak bytes allocated by one call, the largest over a few frames
+    tracemalloc.start()
+    peak = 0
+    for t in range(FRAMES + 1, FRAMES + 21):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        render(fb, t)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return peak
+
+
+def bench_effects(results):
+    import led_patterns
+    from frame_buffer import FrameBuffer
+
+    n = led_patterns.NUM_LEDS
+    fb = FrameBuffer(bytearray(n * 3), n)
+    for mode, cls in sorted(led_patterns.PATTERNS.items()):
+        random.seed(0)
+        effect = cls(fb)
+        effect.init(PARAMS)
+        effect.render(fb, 0)  # Warm up lazily built tables
+
+        start = time.perf_counter_ns()
+        for t in range(1, FRAMES + 1):
+            effect.render(fb, t)
+        results["render_us." + mode] = (time.perf_counter_ns() - start) / FRAMES / 1000
+
+        results["alloc_bytes." + mode] = max(0, peak_alloc(effect.render, fb) - peak_alloc(idle, fb))
+
+        writes = 0
+        last = None
+        for t in range(FRAMES):
+            effect.render(fb, t)
+            crc = crc32(fb.buf)
+            if crc != last:
+                writes += 1
+                last = crc
+        results["writes." + mode] = writes
+
+
+def bench_latency(results):
+    import main
+
+    async def run():
+        controller = main.BleLedController([main.load_settings(dict(main.DEFAULT_SETTINGS))])
+        uart = controller.ble
+        renderer = controller.renderer
+        events = {"selected": 0, "latched": 0}
+        np = renderer.strips[0]
+        write = np.write
+        select = renderer.select
+
+        def timed_write():
+            if not events["latched"]:
+                events["latched"] = time.perf_counter_ns()
+            write()
+
+        def timed_select(*args):
+            select(*args)
+            events["selected"] = time.perf_counter_ns()
+            events["latched"] = 0  # Only latches of the new effect count
+
+        np.write = timed_write
+        renderer.select = timed_select
+        task = asyncio.create_task(controller.run())
+        await asyncio.sleep(0.05)
+        uart.ble.connect()
+        for cmd in LATENCY_MODES:
+            samples = []
+            for _ in range(5):
+                # Switch away first so every sample is a real mode change
+                for msg in ("rainbow_solid", cmd):
+                    await asyncio.sleep(0.03)
+                    events["selected"] = events["latched"] = 0
+                    sent = time.perf_counter_ns()
+                    uart.ble.central_write(uart.rx_handle, msg.encode())
+                    while not (events["selected"] and events["latched"]):
+                        await asyncio.sleep(0)
+                samples.append((events["latched"] - sent) / 1000)
+            results["latency_us." + cmd] = sum(samples) / len(samples)
+        task.cancel()
+
+    asyncio.run(run())
+
+
+def bench_queue(results):
+    from threadsafe_queue import ThreadSafeQueue
+
+    q = ThreadSafeQueue(8)
+    start = time.perf_counter()
+    for i in range(QUEUE_ITEMS):
+        q.put_sync(i)
+        q.get_sync()
+    results["queue_items_s.sync"] = QUEUE_ITEMS / (time.perf_counter() - start)
+
+    async def run():
+        q = ThreadSafeQueue(8)
+        received = 0
+
+        async def consume():
+            nonlocal received
+            async for _ in q:
+                received += 1
+                if received == QUEUE_ITEMS:
+                    return
+
+        consumer = asyncio.create_task(consume())
+        start = time.perf_counter()
+        sent = 0
+        while sent < QUEUE_ITEMS:
+            try:
+                q.put_sync(sent)
+                sent += 1
+            except IndexError:
+                await asyncio.sleep(0)  # Full, let the consumer drain it
+        await consumer
+        return QUEUE_ITEMS / (time.perf_counter() - start)
+
+    results["queue_items_s.async"] = asyncio.run(run())
+
+
+def worse(name, value, base, tolerance):
+    if not name.startswith(GATED):
+        return False
+    return value > base * (1 + tolerance)
+
+
+def main(argv):
+    save = "--save" in argv
+    tolerance = 0.1
+    if "--tolerance" in argv:
+        tolerance = float(argv[argv.index("--tolerance") + 1]) / 100
+
+    cwd = os.getcwd()
+    os.chdir(sim.HOST_DIR)  # Keep settings files out of the repository root
+    try:
+        results = {}
+        bench_effects(results)
+        bench_latency(results)
+        bench_queue(results)
+    finally:
+        os.chdir(cwd)
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as file:
+            baseline = json.load(file)
+
+    regressions = 0
+    for name in sorted(results):
+        value = results[name]
+        base = baseline.get(name)
+        note = ""
+        if base is not None:
+            note = "  (baseline {:.1f})".format(base)
+            if worse(name, value, base, tolerance):
+                note += "  REGRESSION"
+                regressions += 1
+        print("{:32} {:12.1f}{}".format(name, value, note))
+
+    if save:
+        with open(BASELINE_FILE, "w") as file:
+            json.dump({k: round(v, 1) for k, v in sorted(results.items())}, file, indent=1)
+        print("Baseline saved to", BASELINE_FILE)
+    return 1 if regressions and not save else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
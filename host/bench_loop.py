@@ -0,0 +1,85 @@
+# bench_loop.py Event loop wake-ups of an idle BleLedController
+#
+# Usage: python host/bench_loop.py [mode] [seconds]
+#
+# Runs the controller on the host stand-ins with no BLE traffic and counts
+# how often tasks are resumed (every sleep/sleep_ms call, every
+# ThreadSafeFlag.wait() that returns and every wait_for_ms() that times out
+# is one iteration of some task's loop) and how much CPU the process used. A
+# static mode such as "off" or "color" should show close to zero of both; an
+# animated one about one per frame.
+
+import sys
+import time
+
+import sim
+
+sim.install()
+
+import asyncio  # noqa: E402
+import uasyncio  # noqa: E402
+
+
+def bench(mode="off", seconds=3.0):
+    import main
+
+    counts = {"wakeups": 0}
+    sleep = asyncio.sleep
+    sleep_ms = uasyncio.sleep_ms
+    wait = uasyncio.ThreadSafeFlag.wait
+    wait_for_ms = uasyncio.wait_for_ms
+
+    async def counting_sleep(delay, *args):
+        counts["wakeups"] += 1
+        return await sleep(delay, *args)
+
+    async def counting_sleep_ms(ms):
+        counts["wakeups"] += 1
+        return await sleep(ms / 1000)
+
+    async def counting_wait(flag):
+        await wait(flag)
+        counts["wakeups"] += 1
+
+    async def counting_wait_for_ms(aw, timeout):
+        try:
+            return await wait_for_ms(aw, timeout)
+        except asyncio.TimeoutError:
+            counts["wakeups"] += 1
+            raise
+
+    # The firmware imports uasyncio, which re-exports the asyncio names
+    for mod in (asyncio, uasyncio):
+        mod.sleep = counting_sleep
+        mod.sleep_ms = counting_sleep_ms
+    uasyncio.wait_for_ms = counting_wait_for_ms
+    uasyncio.ThreadSafeFlag.wait = counting_wait
+
+    async def run():
+        controller = main.BleLedController()
+        controller.settings.set("mode", mode)
+        task = asyncio.create_task(controller.run())
+        await sleep(0.1)
+        counts["wakeups"] = 0
+        cpu = time.process_time()
+        await sleep(seconds)
+        cpu = time.process_time() - cpu
+        task.cancel()
+        return cpu
+
+    try:
+        cpu = asyncio.run(run())
+    finally:
+        for mod in (asyncio, uasyncio):
+            mod.sleep = sleep
+            mod.sleep_ms = sleep_ms
+        uasyncio.wait_for_ms = wait_for_ms
+        uasyncio.ThreadSafeFlag.wait = wait
+    return counts["wakeups"] / seconds, 100 * cpu / seconds
+
+
+if __name__ == "__main__":
+    mode = sys.argv[1] if len(sys.argv) > 1 else "off"
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+    rate, cpu = bench(mode, seconds)
+    print("mode {}: {:.0f} loop iterations/s, {:.1f}% CPU".format(mode, rate, cpu))
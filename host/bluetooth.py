@@ -0,0 +1,80 @@
+# Host stand-in for the MicroPython bluetooth module
+#
+# Besides the peripheral API the firmware uses, BLE has connect(),
+# disconnect(), exchange_mtu() and central_write() to play the central's side:
+# they fire the registered IRQ handler with the same events and data a real
+# stack would.
+
+IRQ_CENTRAL_CONNECT = 1
+IRQ_CENTRAL_DISCONNECT = 2
+IRQ_GATTS_WRITE = 3
+IRQ_MTU_EXCHANGED = 21
+
+
+class UUID:
+    def __init__(self, value):
+        self.value = value
+
+    def __bytes__(self):
+        if isinstance(self.value, int):
+            return self.value.to_bytes(2, "little")
+        return bytes.fromhex(self.value.replace("-", ""))[::-1]
+
+
+class BLE:
+    def __init__(self):
+        self._irq = None
+        self.notified = []  # (conn_handle, value_handle, data) per gatts_notify()
+        self._values = {}  # value handle -> bytes the central wrote
+        self._append = set()  # Handles whose buffer is in append mode
+
+    def active(self, *args):
+        return True
+
+    def irq(self, handler):
+        self._irq = handler
+
+    def config(self, *args, **kwargs):
+        return None
+
+    def gatts_register_services(self, services):
+        return tuple(tuple(2 * i + 1 for i in range(len(chars))) for _, chars in services)
+
+    def gatts_set_buffer(self, value_handle, size, append=False):
+        if append:
+            self._append.add(value_handle)
+
+    def gatts_read(self, value_handle):
+        if value_handle in self._append:
+            return self._values.pop(value_handle, b"")
+        return self._values.get(value_handle, b"")
+
+    def gatts_write(self, value_handle, data, send_update=False):
+        self._values[value_handle] = bytes(data)
+
+    def gatts_notify(self, conn_handle, value_handle, data=None):
+        self.notified.append((conn_handle, value_handle, bytes(data)))
+
+    def gattc_exchange_mtu(self, conn_handle):
+        pass
+
+    def gap_advertise(self, interval_us, adv_data=None, **kwargs):
+        pass
+
+    def gap_disconnect(self, conn_handle):
+        pass
+
+    def connect(self, conn_handle=0):
+        self._irq(IRQ_CENTRAL_CONNECT, (conn_handle, 0, bytes(6)))
+
+    def disconnect(self, conn_handle=0):
+        self._irq(IRQ_CENTRAL_DISCONNECT, (conn_handle, 0, bytes(6)))
+
+    def exchange_mtu(self, mtu, conn_handle=0):
+        self._irq(IRQ_MTU_EXCHANGED, (conn_handle, mtu))
+
+    def central_write(self, value_handle, data, conn_handle=0):
+        if value_handle in self._append:
+            data = self._values.get(value_handle, b"") + bytes(data)
+        self._values[value_handle] = bytes(data)
+        self._irq(IRQ_GATTS_WRITE, (conn_handle, value_handle))
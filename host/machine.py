@@ -0,0 +1,21 @@
+# Host stand-in for the MicroPython machine module
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+
+    def __init__(self, id, mode=-1, *args, **kwargs):
+        self.id = id
+        self._value = 0
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = 1 if v else 0
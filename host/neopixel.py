@@ -0,0 +1,38 @@
+# Host stand-in for the MicroPython neopixel module (same buffer layout)
+#
+# write() counts latches; with record set it also keeps a copy of the buffer
+# as it was latched in frames.
+
+
+class NeoPixel:
+    ORDER = (1, 0, 2, 3)
+    record = False
+
+    def __init__(self, pin, n, bpp=3, timing=1):
+        self.pin = pin
+        self.n = n
+        self.bpp = bpp
+        self.buf = bytearray(n * bpp)
+        self.writes = 0
+        self.frames = []
+
+    def __len__(self):
+        return self.n
+
+    def __setitem__(self, i, v):
+        offset = i * self.bpp
+        for j in range(self.bpp):
+            self.buf[offset + self.ORDER[j]] = v[j]
+
+    def __getitem__(self, i):
+        offset = i * self.bpp
+        return tuple(self.buf[offset + self.ORDER[j]] for j in range(self.bpp))
+
+    def fill(self, v):
+        for i in range(self.n):
+            self[i] = v
+
+    def write(self):
+        self.writes += 1
+        if self.record:
+            self.frames.append(bytes(self.buf))
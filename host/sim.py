@@ -0,0 +1,58 @@
+# sim.py Run the firmware modules on desktop CPython
+
+# install() puts this directory (with the machine, neopixel, bluetooth,
+# micropython and uasyncio stand-ins) and the repository on sys.path and
+# patches the few MicroPython-only APIs used by the firmware into the
+# standard library modules.
+
+import os
+import sys
+import time
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(HOST_DIR)
+
+HEAP_FREE = 150 * 1024  # What gc.mem_free() reports, see install()
+
+_installed = False
+
+
+def install():
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    for path in (REPO_DIR, HOST_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    import asyncio
+    import gc
+    import hashlib
+    import uasyncio
+
+    asyncio.sleep_ms = uasyncio.sleep_ms
+    asyncio.ThreadSafeFlag = uasyncio.ThreadSafeFlag
+
+    # No MicroPython heap here; report a fixed one the size an ESP32-C3 build
+    # has free after boot, which strip.py and the renderer budget against
+    gc.mem_alloc = lambda: 0
+    gc.mem_free = lambda: HEAP_FREE
+
+    t0 = time.perf_counter()
+    time.ticks_ms = lambda: int((time.perf_counter() - t0) * 1000)
+    time.ticks_us = lambda: int((time.perf_counter() - t0) * 1000000)
+    time.ticks_add = lambda a, b: a + b
+    time.ticks_diff = lambda a, b: a - b
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+
+    # MicroPython hashes str and concatenates bytes with str directly
+    sha1 = hashlib.sha1
+    hashlib.sha1 = lambda data=b"": sha1(data.encode() if isinstance(data, str) else data)
+    import ble_advertising
+    payload = ble_advertising.advertising_payload
+
+    def advertising_payload(name=None, **kwargs):
+        return payload(name=name.encode() if isinstance(name, str) else name, **kwargs)
+
+    ble_advertising.advertising_payload = advertising_payload
@@ -0,0 +1,135 @@
+# test_ble.py RX framing, binary frames, stream packets and MTU of BLEUART
+#
+# Usage: python -m pytest host (or python -m unittest discover host)
+#
+# Writes come in through the central side of the bluetooth stand-in, so they
+# take the same IRQ path as on the device; messages are taken off the queue
+# the way BleLedController.run() does.
+
+import struct
+import unittest
+
+import sim
+
+sim.install()
+
+import asyncio  # noqa: E402
+from ble_uart import BINARY_FRAME, BINARY_MAGIC, BLEUART, STREAM_MAGIC  # noqa: E402
+from machine import Pin  # noqa: E402
+from threadsafe_queue import ThreadSafeQueue  # noqa: E402
+
+FRAME = struct.pack(BINARY_FRAME, BINARY_MAGIC, 0x01, 3, 0, 0, 0, 0, 0)
+
+
+class BLEUARTTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = ThreadSafeQueue(8)
+        self.uart = BLEUART("test", self.queue, Pin(3), rxbuf=64)
+        self.ble = self.uart.ble
+        self.ble.connect()
+
+    def write(self, *writes):
+        for data in writes:
+            self.ble.central_write(self.uart.rx_handle, data)
+
+    def messages(self):
+        out = []
+        while not self.queue.empty():
+            out.append(self.uart.take(self.queue.get_sync()))
+        return out
+
+    def test_write_is_one_message(self):
+        self.write(b"red", b"50%")
+        self.assertEqual(self.messages(), ["red", "50%"])
+        self.assertEqual((self.uart.rx_bytes, self.uart.rx_messages, self.uart.rx_dropped), (6, 2, 0))
+
+    def test_newlines_stay_in_the_message(self):
+        self.write(b"rainbow\n50%\r\n40\n")
+        self.assertEqual(self.messages(), ["rainbow\n50%\r\n40"])
+
+    def test_backslash_continues(self):
+        self.write(b"fire;80%\\")
+        self.assertEqual(self.messages(), [])
+        self.write(b";30")
+        self.assertEqual(self.messages(), ["fire;80%;30"])
+
+    def test_binary_frame(self):
+        self.write(FRAME, b"red")
+        self.assertEqual(self.messages(), [struct.unpack(BINARY_FRAME, FRAME), "red"])
+
+    def test_short_binary_frame_is_dropped(self):
+        self.write(FRAME[:-1])
+        self.assertEqual(self.messages(), [])
+        self.assertEqual(self.uart.rx_dropped, 1)
+
+    def test_binary_frame_discards_continued_text(self):
+        self.write(b"fire\\", FRAME)
+        self.assertEqual(self.messages(), [struct.unpack(BINARY_FRAME, FRAME)])
+        self.assertEqual(self.uart.rx_dropped, 1)
+
+    def test_stream_packets_bypass_the_ring(self):
+        packets = []
+        self.uart.stream = packets.append
+        packet = bytes([STREAM_MAGIC, 3, 0, 0])
+        self.write(b"fire\\", packet, b";30")
+        self.assertEqual(packets, [packet])
+        self.assertEqual(self.messages(), ["fire;30"])
+
+    def test_stream_packets_without_stream_are_ignored(self):
+        self.write(bytes([STREAM_MAGIC, 3, 0, 0]))
+        self.assertEqual(self.messages(), [])
+        self.assertEqual(self.uart.rx_dropped, 0)
+
+    def test_message_longer_than_the_ring_is_dropped(self):
+        self.write(b"x" * 40 + b"\\", b"y" * 40)
+        self.write(b"red")
+        self.assertEqual(self.messages(), ["red"])
+        self.assertEqual(self.uart.rx_dropped, 1)
+
+    def test_full_queue_drops(self):
+        self.write(*[b"%d" % i for i in range(self.queue.capacity + 1)])
+        self.assertEqual(self.messages(), [str(i) for i in range(self.queue.capacity)])
+        self.assertEqual((self.uart.rx_dropped, self.queue.dropped), (1, 1))
+
+    def test_ring_wraps(self):
+        for i in range(20):
+            self.write(b"message %d" % i)
+            self.assertEqual(self.messages(), ["message %d" % i])
+
+    def test_disconnect_drops_half_a_message(self):
+        self.write(b"fire\\")
+        self.ble.disconnect()
+        self.ble.connect()
+        self.write(b"red")
+        self.assertEqual(self.messages(), ["red"])
+
+    def test_mtu_is_the_smallest_connection(self):
+        self.ble.exchange_mtu(247)
+        self.assertEqual(self.uart.mtu, 247)
+        self.ble.connect(1)
+        self.assertEqual(self.uart.mtu, 23)
+        self.ble.exchange_mtu(100, 1)
+        self.assertEqual(self.uart.mtu, 100)
+        self.ble.disconnect(1)
+        self.assertEqual(self.uart.mtu, 247)
+        self.ble.disconnect()
+        self.assertEqual(self.uart.mtu, 23)
+
+    def test_notifications_fit_the_mtu(self):
+        async def run():
+            task = asyncio.create_task(self.uart.run())
+            self.ble.exchange_mtu(247)
+            self.ble.disconnect()
+            self.ble.connect()  # A new central, back at the default MTU
+            self.uart.write("x" * 100)
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+        asyncio.run(run())
+        sizes = [len(data) for _, _, data in self.ble.notified]
+        self.assertEqual(sum(sizes), 101)
+        self.assertLessEqual(max(sizes), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+# test_controller.py Command batches, binary frames and streaming end to end
+#
+# Usage: python -m pytest host (or python -m unittest discover host)
+#
+# A BleLedController runs on the host stand-ins with its render, TX and
+# store tasks, and the writes of a test are sent to it one after another as
+# a central would. Every renderer.select() is counted, since a batch must
+# switch the effect once however many commands it holds.
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import sim
+
+sim.install()
+
+import asyncio  # noqa: E402
+import main  # noqa: E402
+import strip  # noqa: E402
+from ble_uart import BINARY_FRAME, BINARY_MAGIC, STREAM_MAGIC  # noqa: E402
+from led_patterns import Stream  # noqa: E402
+
+
+def frame(op, mode=0, rgb=(0, 0, 0), brightness=0, speed=0):
+    return struct.pack(BINARY_FRAME, BINARY_MAGIC, op, mode, *rgb, brightness, speed)
+
+
+class ControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)  # For the settings and program files
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def session(self, *writes):
+        # Send writes to a fresh controller; returns it once they are handled
+        self.replies = []
+        self.selects = []
+        controller = main.BleLedController([main.load_settings(dict(main.DEFAULT_SETTINGS))])
+        controller.ble.write = self.replies.append
+        select = controller.renderer.select
+
+        def counting_select(mode, *args):
+            self.selects.append(mode)
+            select(mode, *args)
+
+        controller.renderer.select = counting_select
+
+        async def run():
+            task = asyncio.create_task(controller.run())
+            await asyncio.sleep(0.05)
+            self.selects.clear()  # The boot select
+            ble = controller.ble.ble
+            ble.connect()
+            for data in writes:
+                ble.central_write(controller.ble.rx_handle, data)
+                await asyncio.sleep(0.05)
+            task.cancel()
+
+        asyncio.run(run())
+        return controller
+
+    def assertSettings(self, controller, **values):
+        for name, value in values.items():
+            self.assertEqual(getattr(controller.settings, name), value, name)
+
+    def test_batch_switches_once(self):
+        controller = self.session(b"fire;80%;30")
+        self.assertEqual(self.selects, ["fire"])
+        self.assertSettings(controller, mode="fire", brightness=80, speed=30)
+        self.assertEqual(len(self.replies), 1)
+        self.assertIn("Brightness set to 80%\nSpeed set to 30\n", self.replies[0])
+
+    def test_newline_batch_switches_once(self):
+        controller = self.session(b"fire\n80%\n30")
+        self.assertEqual(self.selects, ["fire"])
+        self.assertSettings(controller, mode="fire", brightness=80, speed=30)
+        self.assertEqual(len(self.replies), 1)
+
+    def test_continued_batch_switches_once(self):
+        controller = self.session(b"fire;80%\\", b";30")
+        self.assertEqual(self.selects, ["fire"])
+        self.assertSettings(controller, mode="fire", brightness=80, speed=30)
+
+    def test_query_leaves_the_effect(self):
+        self.session(b"stats")
+        self.assertEqual(self.selects, [])
+        self.assertTrue(self.replies[0].startswith("fps "))
+
+    def test_binary_frame(self):
+        op = main.FRAME_SET_MODE | main.FRAME_SET_COLOR | main.FRAME_SET_BRIGHTNESS
+        controller = self.session(frame(op, main.MODES.index("breathe"), (1, 2, 3), 50, 999))
+        self.assertEqual(self.selects, ["breathe"])
+        self.assertSettings(controller, mode="breathe", color=[1, 2, 3], brightness=50, speed=20)
+
+    def test_binary_frame_out_of_range(self):
+        controller = self.session(frame(main.FRAME_SET_BRIGHTNESS, brightness=101))
+        self.assertEqual(self.selects, [])
+        self.assertSettings(controller, brightness=100)
+        self.assertIn("Brightness value must be between 0% and 100%.", self.replies[0])
+
+    def test_binary_command(self):
+        self.session(frame(main.FRAME_COMMAND, main.COMMANDS.index("mode")))
+        self.assertIn("Mode: off", self.replies[0])
+
+    def test_stream(self):
+        pixels = bytes([STREAM_MAGIC, Stream.PIXELS, 1, 0, 10, 20, 30, 40, 50, 60])
+
+        def commit(seq):
+            return bytes([STREAM_MAGIC, Stream.COMMIT, seq, 0])
+
+        controller = self.session(b"stream", pixels, commit(0), commit(1), commit(3))
+        stream = controller.renderer.segments[0].effect
+        self.assertEqual((stream.frames, stream.dropped, stream.bytes), (3, 1, 22))
+        buf = strip.segments[0][1].buf
+        self.assertEqual(bytes(buf[0:9]), bytes([0, 0, 0, 20, 10, 30, 50, 40, 60]))  # GRB
+
+
+if __name__ == "__main__":
+    unittest.main()
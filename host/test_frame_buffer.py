@@ -0,0 +1,60 @@
+# test_frame_buffer.py The bulk pixel operations of FrameBuffer
+#
+# Usage: python -m pytest host (or python -m unittest discover host)
+#
+# Pixels are checked as lists of packed entries against plain list slicing.
+
+import unittest
+
+import sim
+
+sim.install()
+
+from frame_buffer import FrameBuffer  # noqa: E402
+
+
+def numbered(n, bpp):
+    # A buffer whose pixel i is bpp bytes of i
+    return FrameBuffer(bytearray(i // bpp for i in range(n * bpp)), n, bpp)
+
+
+def pixels(fb):
+    return [bytes(fb.mv[i * fb.bpp:(i + 1) * fb.bpp]) for i in range(fb.n)]
+
+
+class FrameBufferTest(unittest.TestCase):
+    def test_rotate(self):
+        for bpp in (3, 4):
+            for k in (0, 1, 5, 9, 10, 23, -1, -12):
+                fb = numbered(10, bpp)
+                want = pixels(fb)
+                want = want[-(k % 10):] + want[:-(k % 10)] if k % 10 else want
+                fb.rotate(k)
+                self.assertEqual(pixels(fb), want, (bpp, k))
+
+    def test_rotate_segment(self):
+        # A segment is a view into the strip; pixels outside it stay put
+        strip = bytearray(range(30))
+        fb = FrameBuffer(memoryview(strip)[6:21], 5)
+        fb.rotate(2)
+        self.assertEqual(strip, bytearray(range(6)) + bytearray(range(15, 21)) + bytearray(range(6, 15))
+                         + bytearray(range(21, 30)))
+
+    def test_add(self):
+        fb = numbered(4, 3)
+        other = FrameBuffer(bytearray([254] * 12), 4)
+        fb.add(other.buf)
+        self.assertEqual(bytes(fb.buf), bytes([254] * 3 + [255] * 9))
+
+    def test_fill_and_blit(self):
+        fb = numbered(8, 3)
+        px = fb.pack((1, 2, 3))
+        fb.fill(px, start=2, count=3)
+        self.assertEqual(pixels(fb)[1:6], [b"\x01\x01\x01"] + [b"\x02\x01\x03"] * 3 + [b"\x05\x05\x05"])
+        src = numbered(8, 3)
+        fb.blit(src.buf, start=6, src_start=1)
+        self.assertEqual(pixels(fb)[6:], [b"\x01\x01\x01", b"\x02\x02\x02"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+# test_kernels.py The pure-Python kernels against straightforward versions
+#
+# Usage: python -m pytest host (or python -m unittest discover host)
+#
+# The viper kernels must match the Python ones byte for byte (see
+# kernels.py); these tests pin down what the Python ones compute, with
+# independent and obvious code as the reference.
+
+import random
+import struct
+import unittest
+
+import sim
+
+sim.install()
+
+import kernels  # noqa: E402
+from frame_buffer import GRB  # noqa: E402
+
+N = 60
+
+
+def noise(n, seed):
+    rng = random.Random(seed)
+    return bytearray(rng.randrange(256) for _ in range(n))
+
+
+def xorshift_bytes(x, n):
+    # n bytes from successive xorshift32 outputs, least significant first,
+    # and the state after them
+    out = b""
+    while len(out) < n:
+        x ^= (x << 13) & 0xFFFFFFFF
+        x ^= x >> 17
+        x ^= (x << 5) & 0xFFFFFFFF
+        out += struct.pack("<I", x)
+    return out[:n], x
+
+
+class KernelTest(unittest.TestCase):
+    def test_scale_buf(self):
+        for factor in (0, 1, 128, 255, 256):
+            buf = noise(N, factor)
+            want = bytearray(v * factor // 256 for v in buf[:N - 5]) + buf[N - 5:]
+            kernels.scale_buf_py(buf, N - 5, factor)
+            self.assertEqual(buf, want)
+
+    def test_add_sat(self):
+        src = noise(N, 7)
+        dst = noise(N, 8)
+        want = bytearray(min(255, d + s) for d, s in zip(dst[:N - 5], src)) + dst[N - 5:]
+        kernels.add_sat_py(dst, src, N - 5)
+        self.assertEqual(dst, want)
+
+    def test_blend(self):
+        src = noise(N, 1)
+        for w in (0, 1, 100, 255, 256):
+            dst = noise(N, 2)
+            want = bytearray((d * w + s * (256 - w)) // 256 for d, s in zip(dst, src))
+            kernels.blend_py(dst, src, N, w)
+            self.assertEqual(dst, want)
+        self.assertEqual(dst, noise(N, 2))  # w = 256 keeps dst
+
+    def test_heat_diffuse(self):
+        heat = noise(N, 3)
+        want = list(heat)
+        for i in range(N - 1, 1, -1):
+            want[i] = (want[i - 1] + 2 * want[i - 2]) // 3
+        kernels.heat_diffuse_py(heat, N)
+        self.assertEqual(list(heat), want)
+
+    def test_rand_fill(self):
+        for seed in (1, 0x12345678, 0xFFFFFFFF):
+            for n in (1, 4, 7, N):
+                state = bytearray(struct.pack("<I", seed))
+                buf = bytearray(n)
+                want, x = xorshift_bytes(seed, n)
+                kernels.rand_fill_py(buf, n, state)
+                self.assertEqual(bytes(buf), want)
+                self.assertEqual(state, struct.pack("<I", x))
+
+    def test_heat_cool_draws_as_rand_fill(self):
+        for cooldown in (0, 55, 255):
+            state = bytearray(struct.pack("<I", 0x2545F491))
+            rand = bytearray(N)
+            kernels.rand_fill_py(rand, N, bytearray(state))
+            heat = noise(N, cooldown)
+            want = bytearray(max(0, h - r * (cooldown + 1) // 256) for h, r in zip(heat, rand))
+            kernels.heat_cool_py(heat, N, cooldown, state)
+            self.assertEqual(heat, want)
+
+    def test_lut_fill(self):
+        for bpp in (3, 4):
+            table = noise(256 * bpp, bpp)
+            indexes = noise(N, 5)
+            dst = bytearray(N * bpp)
+            want = bytearray()
+            for idx in indexes:
+                e = (idx + 77) % 256
+                want += table[e * bpp:(e + 1) * bpp]
+            kernels.lut_fill_py(dst, table, indexes, 77)
+            self.assertEqual(dst, want)
+
+    def test_mirror(self):
+        for n in (1, 2, 7, N):
+            buf = noise(n * 3, n)
+            pixels = [buf[i * 3:i * 3 + 3] for i in range(n)]
+            want = b"".join(pixels[:(n + 1) // 2] + pixels[:n // 2][::-1])
+            kernels.mirror_py(buf, n, 3)
+            self.assertEqual(bytes(buf), want)
+
+    def test_rgb_copy(self):
+        src = noise(N * 3, 6)
+        for order in (GRB, (0, 1, 2, 3)):
+            for bpp in (3, 4):
+                dst = bytearray(b"\xaa" * N * bpp)
+                want = bytearray(dst)
+                for i in range(N):
+                    for c in range(3):
+                        want[i * bpp + order[c]] = src[i * 3 + c]
+                kernels.rgb_copy_py(dst, src, N, order[0] | order[1] << 2 | order[2] << 4 | bpp << 6)
+                self.assertEqual(dst, want)
+
+    def test_host_uses_python_kernels(self):
+        self.assertFalse(kernels.NATIVE)
+        self.assertIs(kernels.blend, kernels.blend_py)
+
+
+if __name__ == "__main__":
+    unittest.main()
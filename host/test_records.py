@@ -0,0 +1,131 @@
+# test_records.py The settings, layout and program records on flash
+#
+# Usage: python -m pytest host (or python -m unittest discover host)
+#
+# Every record must come back as it was written, and a record cut short or
+# with any single bit flipped must be refused (None) rather than half loaded.
+# A write that fails must leave the settings store running and retrying.
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+import sim
+
+sim.install()
+
+import settings  # noqa: E402
+
+NAMED = {"mode": "color", "color": "red", "brightness": 80, "speed": 35, "curve": "default"}
+RGB = {"mode": "breathe", "color": [255, 64, 0], "brightness": 100, "speed": 20, "curve": "cie"}
+STRIPS = ((2, 180, "grb"), (4, 60, "rgbw"))
+SEGMENTS = ((2, 0, 120), (2, 120, 60), (4, 0, 60))
+STEPS = [(NAMED, 2000, 0), (RGB, 5000, 750)]
+
+
+def damaged(data):
+    # Every proper prefix of data, then data with each single bit flipped
+    for n in range(len(data)):
+        yield data[:n]
+    for i in range(len(data) * 8):
+        copy = bytearray(data)
+        copy[i >> 3] ^= 1 << (i & 7)
+        yield bytes(copy)
+
+
+class RecordTest(unittest.TestCase):
+    def test_named_color_round_trip(self):
+        self.assertEqual(settings.decode_record(settings.encode_record(NAMED)), NAMED)
+
+    def test_rgb_color_round_trip(self):
+        self.assertEqual(settings.decode_record(settings.encode_record(RGB)), RGB)
+
+    def test_damaged_record(self):
+        for values in (NAMED, RGB):
+            for data in damaged(settings.encode_record(values)):
+                self.assertIsNone(settings.decode_record(data), data)
+
+    def test_layout_round_trip(self):
+        self.assertEqual(settings.decode_layout(settings.encode_layout(STRIPS, SEGMENTS)), (STRIPS, SEGMENTS))
+
+    def test_damaged_layout(self):
+        for data in damaged(settings.encode_layout(STRIPS, SEGMENTS)):
+            self.assertIsNone(settings.decode_layout(data), data)
+
+    def test_program_round_trip(self):
+        self.assertEqual(settings.decode_program(settings.encode_program(STEPS)), STEPS)
+
+    def test_damaged_program(self):
+        for data in damaged(settings.encode_program(STEPS)):
+            self.assertIsNone(settings.decode_program(data), data)
+
+
+class InTempDir(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def write(self, path, data):
+        with open(path, "wb") as file:
+            file.write(data)
+
+
+class ReadSavedTest(InTempDir):
+    def test_nothing_saved(self):
+        self.assertIsNone(settings.read_saved())
+
+    def test_saved(self):
+        self.write(settings.SETTINGS_FILE, settings.encode_record(NAMED))
+        self.assertEqual(settings.read_saved(), NAMED)
+
+    def test_corrupt_record_falls_back_to_temp(self):
+        # A power cut between writing the temp file and the rename
+        record = bytearray(settings.encode_record(NAMED))
+        record[-1] ^= 0x80
+        self.write(settings.SETTINGS_FILE, record)
+        self.write(settings.TEMP_FILE, settings.encode_record(RGB))
+        self.assertEqual(settings.read_saved(), RGB)
+
+    def test_other_segment(self):
+        path, temp = settings.files(1)
+        self.write(path, b"LS")
+        self.write(temp, settings.encode_record(RGB))
+        self.assertEqual(settings.read_saved(1), RGB)
+        self.assertIsNone(settings.read_saved())
+
+
+class StoreTest(InTempDir):
+    def test_failed_write_is_retried(self):
+        reports = []
+        values = settings.Settings(NAMED)
+        store = settings.SettingsStore([values], lambda written, error: reports.append((written, error)),
+                                       debounce_ms=0)
+
+        async def run():
+            task = asyncio.create_task(store.run())
+            os.mkdir(settings.TEMP_FILE)  # Opening it for writing fails
+            store.save()
+            await asyncio.sleep(0.05)
+            os.rmdir(settings.TEMP_FILE)
+            store.save()
+            await asyncio.sleep(0.05)
+            self.assertFalse(task.done())
+            task.cancel()
+
+        asyncio.run(run())
+        self.assertEqual(len(reports), 2)
+        self.assertIsInstance(reports[0][1], OSError)
+        self.assertEqual(reports[1], (True, None))
+        self.assertEqual((store.writes, store.failed), (1, 1))
+        self.assertEqual(settings.read_saved(), NAMED)
+
+
+if __name__ == "__main__":
+    unittest.main()
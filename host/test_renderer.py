@@ -0,0 +1,154 @@
+# test_renderer.py Effects and programs rendered frame by frame, no asyncio
+#
+# Usage: python -m pytest host (or python -m unittest discover host)
+#
+# Renderer.render() draws the frame due at scheduler.deadline, so setting
+# the deadline by hand and calling it in a loop renders any number of frames
+# at exact times, the way the render task would but without sleeping.
+
+import random
+import unittest
+
+import sim
+
+sim.install()
+
+import easing  # noqa: E402
+import led_patterns  # noqa: E402
+import time  # noqa: E402
+from frame_buffer import FrameBuffer  # noqa: E402
+from machine import Pin  # noqa: E402
+from neopixel import NeoPixel  # noqa: E402
+from renderer import Renderer  # noqa: E402
+
+N = 30
+RED = {"color": (255, 0, 0), "brightness": 100, "speed": 20}
+BLUE = {"color": (0, 0, 255), "brightness": 100, "speed": 20}
+
+
+def renderer(segments=((0, N),)):
+    # A renderer over one strip split into segments of (first LED, LEDs)
+    np = NeoPixel(Pin(2), N)
+    fbs = [(0, FrameBuffer(memoryview(np.buf)[start * 3:(start + n) * 3], n)) for start, n in segments]
+    return Renderer([np], fbs, led_patterns.PATTERNS)
+
+
+def draw(r, at):
+    # Render and latch the frame due at ticks_ms at; True if it was written
+    r.scheduler.deadline = at
+    r.render()
+    writes = r.scheduler.writes
+    r.scheduler.latch(r.dirty)
+    return r.scheduler.writes > writes
+
+
+def rgb(r, i=0):
+    # Pixel i of the strip as (r, g, b)
+    g, red, b = r.strips[0].buf[3 * i:3 * i + 3]
+    return red, g, b
+
+
+class RendererTest(unittest.TestCase):
+    def frames(self, mode, count):
+        random.seed(1)
+        r = renderer()
+        r.select(mode, RED)
+        origin = r.segments[0].origin
+        out = []
+        for t in range(count):
+            draw(r, origin + 20 * t)
+            out.append(bytes(r.strips[0].buf))
+        return out
+
+    def test_frames_are_deterministic(self):
+        for mode in ("fire", "sparkle", "rainbow_cycle", "meteor_rain"):
+            self.assertEqual(self.frames(mode, 50), self.frames(mode, 50), mode)
+
+    def test_frames_match_the_effect(self):
+        # The renderer draws frame t of the effect at origin + t * speed
+        frames = self.frames("rainbow_cycle", 10)
+        fb = FrameBuffer(bytearray(N * 3), N)
+        effect = led_patterns.PATTERNS["rainbow_cycle"](fb)
+        effect.init(RED)
+        for t in range(10):
+            effect.render(fb, t)
+            self.assertEqual(frames[t], bytes(fb.buf), t)
+
+    def test_static_effect_is_drawn_once(self):
+        r = renderer()
+        r.select("color", RED)
+        origin = r.segments[0].origin
+        self.assertTrue(draw(r, origin))
+        self.assertEqual(rgb(r), (255, 0, 0))
+        for t in range(1, 5):
+            self.assertFalse(draw(r, origin + 20 * t))
+        r.commit()
+        r.render()
+        self.assertEqual(r.dirty[0], 1)  # Drawn again, though unchanged
+
+    def test_segments_keep_their_own_speed(self):
+        r = renderer(((0, 10), (10, 20)))
+        r.select("rainbow_cycle", dict(RED, speed=20), segment=0)
+        r.select("rainbow_cycle", dict(RED, speed=60), segment=1)
+        self.assertEqual(r.scheduler.interval, 20)
+        origin = r.segments[1].origin
+        for t in range(7):
+            draw(r, origin + 20 * t)
+            self.assertEqual(r.segments[1].t, t // 3)
+
+    def test_program_steps(self):
+        r = renderer()
+        r.play([("color", RED, 100, 0), ("color", BLUE, 50, 0)])
+        start = r.segments[0].origin
+        for at, color in ((0, (255, 0, 0)), (99, (255, 0, 0)), (100, (0, 0, 255)), (149, (0, 0, 255)),
+                          (150, (255, 0, 0)), (420, (0, 0, 255))):
+            draw(r, start + at)
+            self.assertEqual(rgb(r), color, at)
+
+    def test_crossfade(self):
+        r = renderer()
+        r.play([("rainbow_solid", RED, 100, 0), ("color", BLUE, 100, 50)])
+        start = r.segments[0].origin
+        draw(r, start + 99)
+        old = rgb(r)
+        draw(r, start + 125)
+        w = easing.ease(easing.SINE, easing.ONE // 2)
+        self.assertEqual(rgb(r)[2], (255 * w) >> 8)
+        self.assertTrue(r.segments[0].fading)
+        draw(r, start + 150)
+        self.assertEqual(rgb(r), (0, 0, 255))
+        self.assertFalse(r.segments[0].fading)
+        self.assertNotEqual(old, (0, 0, 255))
+
+    def test_crossfade_within_one_mode(self):
+        # Both steps share one effect object; the fade starts from the still
+        # frame of the outgoing step and follows the sine curve
+        r = renderer()
+        r.play([("color", RED, 100, 0), ("color", BLUE, 100, 50)])
+        start = r.segments[0].origin
+        draw(r, start)
+        for at in (0, 10, 25, 40, 50):
+            draw(r, start + 100 + at)
+            w = easing.ease(easing.SINE, at * easing.ONE // 50) if at < 50 else 256
+            self.assertEqual(rgb(r), ((255 * (256 - w)) >> 8, 0, (255 * w) >> 8), at)
+
+    def test_no_back_buffer_cuts(self):
+        r = renderer()
+        r.plan(0)  # No budget for the back buffer
+        r.play([("color", RED, 100, 0), ("color", BLUE, 100, 50)])
+        start = r.segments[0].origin
+        draw(r, start + 110)
+        self.assertEqual(rgb(r), (0, 0, 255))
+        self.assertIsNone(r.segments[0].back)
+
+    def test_select_ends_the_program(self):
+        r = renderer()
+        r.play([("color", RED, 100, 0), ("color", BLUE, 100, 50)])
+        r.select("color", BLUE)
+        self.assertIsNone(r.segments[0].program)
+        draw(r, time.ticks_add(r.segments[0].origin, 500))
+        self.assertEqual(rgb(r), (0, 0, 255))
+
+
+if __name__ == "__main__":
+    unittest.main()
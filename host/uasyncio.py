@@ -0,0 +1,33 @@
+# Host stand-in for uasyncio on top of CPython asyncio
+
+import asyncio
+from asyncio import *  # noqa: F401,F403
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(aw, timeout):
+    return await asyncio.wait_for(aw, timeout / 1000)
+
+
+class ThreadSafeFlag:
+    def __init__(self):
+        self._event = None
+
+    def _get(self):
+        if self._event is None:
+            self._event = asyncio.Event()  # Bound to the running loop on first use
+        return self._event
+
+    def set(self):
+        self._get().set()
+
+    def clear(self):
+        self._get().clear()
+
+    async def wait(self):
+        event = self._get()
+        await event.wait()
+        event.clear()
@@ -0,0 +1,130 @@
+# kernels.py Per-pixel inner loops working directly on bytearrays
+
+# The functions below are the pure-Python reference implementations. When the
+# firmware has the native emitter, the @micropython.viper versions from
+# kernels_viper.py replace them at import time; both produce identical output,
+# so the Python ones can be checked on a desktop interpreter. NATIVE tells
+# which set is in use.
+
+
+def scale_buf_py(buf, n, factor):
+    # buf[i] = buf[i] * factor / 256 for the first n bytes
+    for i in range(n):
+        buf[i] = (buf[i] * factor) >> 8
+
+
+def add_sat_py(dst, src, n):
+    # dst[i] += src[i], saturating at 255
+    for i in range(n):
+        v = dst[i] + src[i]
+        dst[i] = v if v < 256 else 255
+
+
+def blend_py(dst, src, n, w):
+    # dst[i] = mix of dst[i] (weight w) and src[i] (weight 256 - w)
+    for i in range(n):
+        dst[i] = (dst[i] * w + src[i] * (256 - w)) >> 8
+
+
+def heat_diffuse_py(heat, n):
+    # Heat drifts upward: cell i takes the weighted average of the two below
+    for i in range(n - 1, 1, -1):
+        heat[i] = ((heat[i - 1] + heat[i - 2] + heat[i - 2]) * 43691) >> 17  # // 3
+
+
+def xorshift32(x):
+    x ^= (x << 13) & 0xFFFFFFFF
+    x ^= x >> 17
+    x ^= (x << 5) & 0xFFFFFFFF
+    return x
+
+
+def rand_fill_py(buf, n, state):
+    # Fill n bytes of buf from the xorshift32 generator whose 32-bit state is
+    # kept little-endian in the bytearray state; every step gives four bytes
+    x = state[0] | state[1] << 8 | state[2] << 16 | state[3] << 24
+    r = x
+    for i in range(n):
+        if not i & 3:
+            x = r = xorshift32(x)
+        buf[i] = r & 255
+        r >>= 8
+    state[0] = x & 255
+    state[1] = (x >> 8) & 255
+    state[2] = (x >> 16) & 255
+    state[3] = x >> 24
+
+
+def heat_cool_py(heat, n, cooldown, state):
+    # heat[i] -= a random amount from 0 to cooldown, stopping at 0, with the
+    # random bytes drawn as in rand_fill
+    x = state[0] | state[1] << 8 | state[2] << 16 | state[3] << 24
+    r = x
+    scale = cooldown + 1
+    for i in range(n):
+        if not i & 3:
+            x = r = xorshift32(x)
+        v = heat[i] - (((r & 255) * scale) >> 8)
+        heat[i] = v if v > 0 else 0
+        r >>= 8
+    state[0] = x & 255
+    state[1] = (x >> 8) & 255
+    state[2] = (x >> 16) & 255
+    state[3] = x >> 24
+
+
+def lut_fill_py(dst, table, indexes, offset):
+    # Pixel i of dst takes table entry (indexes[i] + offset) & 255
+    bpp = len(table) >> 8
+    o = 0
+    for idx in indexes:
+        s = ((idx + offset) & 255) * bpp
+        for k in range(bpp):
+            dst[o + k] = table[s + k]
+        o += bpp
+
+
+def mirror_py(buf, n, bpp):
+    # Pixel n - 1 - i takes pixel i for the first n // 2 pixels, so the
+    # second half of the strip reflects the first
+    for i in range(n >> 1):
+        o = i * bpp
+        m = (n - 1 - i) * bpp
+        for k in range(bpp):
+            buf[m + k] = buf[o + k]
+
+
+def rgb_copy_py(dst, src, n, order):
+    # n pixels of r, g, b bytes from src into dst in the strip's byte order.
+    # order packs the offsets of r, g and b and the pixel size of dst into
+    # bit fields: r | g << 2 | b << 4 | bpp << 6
+    o0 = order & 3
+    o1 = (order >> 2) & 3
+    o2 = (order >> 4) & 3
+    bpp = order >> 6
+    o = 0
+    s = 0
+    for _ in range(n):
+        dst[o + o0] = src[s]
+        dst[o + o1] = src[s + 1]
+        dst[o + o2] = src[s + 2]
+        o += bpp
+        s += 3
+
+
+scale_buf = scale_buf_py
+add_sat = add_sat_py
+blend = blend_py
+heat_diffuse = heat_diffuse_py
+rand_fill = rand_fill_py
+heat_cool = heat_cool_py
+lut_fill = lut_fill_py
+mirror = mirror_py
+rgb_copy = rgb_copy_py
+NATIVE = False
+
+try:
+    from kernels_viper import scale_buf, add_sat, blend, heat_diffuse, rand_fill, heat_cool, lut_fill, mirror, rgb_copy
+    NATIVE = True
+except (ImportError, SyntaxError, AttributeError):
+    pass  # Not MicroPython, or a firmware built without the native emitter
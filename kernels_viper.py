@@ -0,0 +1,129 @@
+# kernels_viper.py Viper compiled versions of the kernels in kernels.py
+
+# Only imported through kernels.py. Viper functions take at most four
+# arguments, so lut_fill derives its sizes from the buffers it is given.
+
+import micropython
+
+
+@micropython.viper
+def scale_buf(buf, n: int, factor: int):
+    p = ptr8(buf)
+    for i in range(n):
+        p[i] = (p[i] * factor) >> 8
+
+
+@micropython.viper
+def add_sat(dst, src, n: int):
+    d = ptr8(dst)
+    s = ptr8(src)
+    for i in range(n):
+        v = d[i] + s[i]
+        if v > 255:
+            v = 255
+        d[i] = v
+
+
+@micropython.viper
+def blend(dst, src, n: int, w: int):
+    d = ptr8(dst)
+    s = ptr8(src)
+    v = 256 - w
+    for i in range(n):
+        d[i] = (d[i] * w + s[i] * v) >> 8
+
+
+@micropython.viper
+def heat_diffuse(heat, n: int):
+    h = ptr8(heat)
+    i = n - 1
+    while i > 1:
+        h[i] = ((h[i - 1] + h[i - 2] + h[i - 2]) * 43691) >> 17
+        i -= 1
+
+
+@micropython.viper
+def rand_fill(buf, n: int, state):
+    d = ptr8(buf)
+    s = ptr8(state)
+    x = uint(s[0]) | (uint(s[1]) << 8) | (uint(s[2]) << 16) | (uint(s[3]) << 24)
+    r = x
+    for i in range(n):
+        if not (i & 3):
+            x ^= x << 13
+            x ^= x >> 17
+            x ^= x << 5
+            r = x
+        d[i] = int(r & 255)
+        r >>= 8
+    s[0] = int(x & 255)
+    s[1] = int((x >> 8) & 255)
+    s[2] = int((x >> 16) & 255)
+    s[3] = int(x >> 24)
+
+
+@micropython.viper
+def heat_cool(heat, n: int, cooldown: int, state):
+    h = ptr8(heat)
+    s = ptr8(state)
+    x = uint(s[0]) | (uint(s[1]) << 8) | (uint(s[2]) << 16) | (uint(s[3]) << 24)
+    r = x
+    scale = cooldown + 1
+    for i in range(n):
+        if not (i & 3):
+            x ^= x << 13
+            x ^= x >> 17
+            x ^= x << 5
+            r = x
+        v = int(h[i]) - ((int(r & 255) * scale) >> 8)
+        if v < 0:
+            v = 0
+        h[i] = v
+        r >>= 8
+    s[0] = int(x & 255)
+    s[1] = int((x >> 8) & 255)
+    s[2] = int((x >> 16) & 255)
+    s[3] = int(x >> 24)
+
+
+@micropython.viper
+def lut_fill(dst, table, indexes, offset: int):
+    d = ptr8(dst)
+    t = ptr8(table)
+    x = ptr8(indexes)
+    n = int(len(indexes))
+    bpp = int(len(table)) >> 8
+    o = 0
+    for i in range(n):
+        s = ((x[i] + offset) & 255) * bpp
+        for k in range(bpp):
+            d[o + k] = t[s + k]
+        o += bpp
+
+
+@micropython.viper
+def mirror(buf, n: int, bpp: int):
+    p = ptr8(buf)
+    for i in range(n >> 1):
+        o = i * bpp
+        m = (n - 1 - i) * bpp
+        for k in range(bpp):
+            p[m + k] = p[o + k]
+
+
+@micropython.viper
+def rgb_copy(dst, src, n: int, order: int):
+    d = ptr8(dst)
+    s = ptr8(src)
+    o0 = order & 3
+    o1 = (order >> 2) & 3
+    o2 = (order >> 4) & 3
+    bpp = order >> 6
+    o = 0
+    i = 0
+    for _ in range(n):
+        d[o + o0] = s[i]
+        d[o + o1] = s[i + 1]
+        d[o + o2] = s[i + 2]
+        o += bpp
+        i += 3
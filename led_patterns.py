@@ -1,239 +1,404 @@
-import math
 import random
-from machine import Pin
-from neopixel import NeoPixel
-import uasyncio as asyncio
-
-COLORS = {
-    "black": (0, 0, 0),
-    "white": (255, 255, 255),
-    "red": (255, 0, 0),
-    "pink": (255, 20, 147),
-    "magenta": (255, 0, 255),
-    "purple": (128, 0, 128),
-    "blue": (0, 0, 255),
-    "cyan": (0, 255, 255),
-    "teal": (0, 128, 128),
-    "green": (0, 255, 0),
-    "yellow": (255, 255, 0),
-    "orange": (255, 165, 0),
-    "warm": (255, 223, 180)
-}
+from array import array
+import easing
+import kernels
+import palette
+from frame_buffer import FrameBuffer
+from palette import COLORS, color_wheel, heat_to_color
+from strip import NUM_LEDS, NEOPIXEL_LEDS_PIN, np, fb
+
+def random_state():
+    # Seed for the kernels.rand_fill generator, never all zero
+    return bytearray(random.getrandbits(8) | 1 for _ in range(4))
+
+# Effects are objects created once per frame buffer and kept across mode
+# switches. init(params) takes the "color" (an (r, g, b) tuple or None),
+# "brightness" and "speed" settings, and "curve" (an easing table or None
+# for the effect's own), and precomputes whatever the effect needs;
+# render(fb, t) then draws frame t. Frame t is a position in time (it skips
+# ahead when frames are dropped), so effects derive their state from it and
+# rendering N frames needs nothing but a loop. Effects whose frames never
+# change set animated = False and are only rendered when (re)selected.
+#
+# All per-pixel state lives in bytearrays allocated by __init__, and
+# state_bytes(n, bpp) says how many bytes that is for n pixels of bpp bytes,
+# so the renderer can check an effect fits before creating it. The shared
+# palette tables are not counted; they come out of strip.HEAP_RESERVE.
+
+class Effect:
+    animated = True
+
+    def __init__(self, fb):
+        self.fb = fb
+
+    @classmethod
+    def state_bytes(cls, n, bpp):
+        return 0
+
+    def init(self, params):
+        self.brightness = params.get("brightness", 100)
+        self.color = params.get("color") or COLORS["white"]
+
+    def render(self, fb, t):
+        pass
 
-NUM_LEDS = 180
-NEOPIXEL_LEDS_PIN = 2
-np = NeoPixel(Pin(NEOPIXEL_LEDS_PIN), NUM_LEDS)
-
-def color_wheel(pos):
-    if pos < 85:
-        return (pos * 3, 255 - pos * 3, 0)
-    elif pos < 170:
-        pos -= 85
-        return (255 - pos * 3, 0, pos * 3)
-    else:
-        pos -= 170
-        return (0, pos * 3, 255 - pos * 3)
-
-async def rainbow(brightness=100, speed=20):
+class Off(Effect):
+    animated = False
+
+    def render(self, fb, t):
+        fb.clear()
+
+class Solid(Effect):
+    animated = False
+
+    def init(self, params):
+        super().init(params)
+        self.px = self.fb.pack(palette.scale(self.color, self.brightness))
+
+    def render(self, fb, t):
+        fb.fill(self.px)
+
+class Rainbow(Effect):
     """Displays a cycling rainbow effect across all LEDs."""
-    brightness = max(0, min(brightness, 100)) / 100  # Normalize brightness to 0-1 scale
-    
-    for j in range(256):
-        for i in range(NUM_LEDS):
-            color = color_wheel((i + j) & 255)
-            adjusted_color = tuple(int(c * brightness) for c in color)
-            np[i] = adjusted_color
-        np.write()
-        await asyncio.sleep_ms(speed)
-        
-async def rainbow_cycle(brightness=100, speed=20):
-    brightness = max(0, min(brightness, 100)) / 100  # Normalize brightness to 0-1 scale
-    
-    while True:
-        for j in range(256):
-            for i in range(NUM_LEDS):
-                color = color_wheel((int(i * 256 / NUM_LEDS) + j) & 255)
-                adjusted_color = tuple(int(c * brightness) for c in color)
-                np[i] = adjusted_color
-            np.write()
-            await asyncio.sleep_ms(speed)
-        
-async def rainbow_solid(brightness=100, speed=20):
-    brightness = max(0, min(brightness, 100)) / 100  # Normalize brightness to 0-1 scale
-    
-    while True:
-        for j in range(256):
-            color = color_wheel(j)  # Get the color for this step in the wheel
-            adjusted_color = tuple(int(c * brightness) for c in color)
-            np.fill(adjusted_color)  # Set all LEDs to the same color
-            np.write()
-            await asyncio.sleep_ms(speed)
-        
-async def theatre_chase(color, brightness=100, speed=100):
-    brightness = max(0, min(brightness, 100)) / 100  # Normalize brightness to 0-1 scale
-    adjusted_color = tuple(int(c * brightness) for c in color)  # Adjust color for brightness
-    
-    while True:
-        # Theatre chase effect with the specified color
-        for _ in range(10):  # Number of cycles for the chase effect
-            for q in range(3):  # Three steps in the chase pattern
-                for i in range(0, NUM_LEDS, 3):
-                    np[i + q] = adjusted_color  # Set every third LED to the color
-                np.write()
-                await asyncio.sleep_ms(speed)
-                for i in range(0, NUM_LEDS, 3):
-                    np[i + q] = (0, 0, 0)  # Turn off every third LED after each cycle
-                
-async def fade_in_out(color, brightness=100, speed=20):
-    brightness = max(0, min(brightness, 100)) / 100  # Normalize brightness to 0-1 scale
-
-    while True:
-        # Fade in
-        for level in range(0, 101):  # From 0% to 100%
-            adjusted_color = tuple(int(c * (level / 100) * brightness) for c in color)
-            np.fill(adjusted_color)
-            np.write()
-            await asyncio.sleep_ms(speed)
-        
-        # Fade out
-        for level in range(100, -1, -1):  # From 100% to 0%
-            adjusted_color = tuple(int(c * (level / 100) * brightness) for c in color)
-            np.fill(adjusted_color)
-            np.write()
-            await asyncio.sleep_ms(speed)
-        
-async def color_wipe(color, brightness=100, speed=50):
-    brightness = max(0, min(brightness, 100)) / 100  # Normalize brightness to 0-1 scale
-    adjusted_color = tuple(int(c * brightness) for c in color)  # Adjust color for brightness
-    
-    while True:
-        # Wipe forward
-        for i in range(NUM_LEDS):
-            np[i] = adjusted_color
-            np.write()
-            await asyncio.sleep_ms(speed)
-        
-        # Clear LEDs
-        for i in range(NUM_LEDS):
-            np[i] = (0, 0, 0)
-            np.write()
-            await asyncio.sleep_ms(speed)
-
-async def breathe(color, brightness=100, speed=20):
-    max_brightness = max(0, min(brightness, 100)) / 100  # Normalize brightness to 0-1 scale
-
-    while True:
-        # Fade in
-        for level in range(0, 101):  # 0% to 100%
-            adjusted_brightness = (math.sin(level * math.pi / 100 - math.pi / 2) + 1) / 2 * max_brightness
-            adjusted_color = tuple(int(c * adjusted_brightness) for c in color)
-            np.fill(adjusted_color)
-            np.write()
-            await asyncio.sleep_ms(speed)
-
-        # Fade out
-        for level in range(100, -1, -1):  # 100% to 0%
-            adjusted_brightness = (math.sin(level * math.pi / 100 - math.pi / 2) + 1) / 2 * max_brightness
-            adjusted_color = tuple(int(c * adjusted_brightness) for c in color)
-            np.fill(adjusted_color)
-            np.write()
-            await asyncio.sleep_ms(speed)
-
-
-async def sparkle(color, brightness=100, speed=50, sparkle_count=15, fade_speed=50):
-    brightness = max(0, min(brightness, 100)) / 100  # Normalize brightness to 0-1 scale
-    adjusted_color = tuple(int(c * brightness) for c in color)  # Adjust color for brightness
-
-    while True:
-        # Turn off all LEDs initially
-        np.fill((0, 0, 0))
-        
-        # Randomly select LEDs to sparkle
-        sparkle_indices = set()
-        while len(sparkle_indices) < sparkle_count:
-            sparkle_indices.add(random.randint(0, NUM_LEDS - 1))
-        
-        for i in sparkle_indices:
-            np[i] = adjusted_color  # Set selected LEDs to the sparkle color
-        np.write()
-        
-        # Brief delay to show sparkles
-        await asyncio.sleep_ms(speed)
-        
-        # Fade out sparkles by turning them off
-        for i in sparkle_indices:
-            np[i] = (0, 0, 0)
-        np.write()
-        
-        # Delay to control sparkle refresh rate
-        await asyncio.sleep_ms(fade_speed)
-        
-async def fire(brightness=100, cooldown=55, heat_increment=40, speed=30):
-    brightness = max(0, min(brightness, 100)) / 100  # Normalize brightness to 0-1 scale
-    heat = [0] * NUM_LEDS  # Initialize heat array for each LED
-
-    while True:
+    def __init__(self, fb):
+        super().__init__(fb)
+        # Frame j shows hues j..j+n-1, so the wheel is rendered once over
+        # n + 255 pixels and each frame copies a sliding window out of it
+        span = fb.n + 255
+        self.strip = FrameBuffer(bytearray(span * fb.bpp), span, fb.bpp, fb.order)
+        self.hues = bytearray(i & 255 for i in range(span))
+
+    @classmethod
+    def state_bytes(cls, n, bpp):
+        return (n + 255) * (bpp + 1)
+
+    def init(self, params):
+        super().init(params)
+        self.strip.lookup(palette.wheel(self.brightness, self.fb.order), self.hues)
+
+    def render(self, fb, t):
+        fb.blit(self.strip.buf, src_start=min(t, 255))  # A single pass
+
+class RainbowCycle(Effect):
+    def __init__(self, fb):
+        super().__init__(fb)
+        # One full wheel spread over the strip, stored twice so every
+        # rotation of it is a plain window copy
+        n = fb.n
+        self.strip = FrameBuffer(bytearray(2 * n * fb.bpp), 2 * n, fb.bpp, fb.order)
+        self.hues = bytearray(((i % n) * 256 // n) & 255 for i in range(2 * n))
+
+    @classmethod
+    def state_bytes(cls, n, bpp):
+        return 2 * n * (bpp + 1)
+
+    def init(self, params):
+        super().init(params)
+        self.strip.lookup(palette.wheel(self.brightness, self.fb.order), self.hues)
+
+    def render(self, fb, t):
+        # One hue step per frame is n / 256 pixels
+        fb.blit(self.strip.buf, src_start=(t & 255) * fb.n >> 8)
+
+class RainbowSolid(Effect):
+    def init(self, params):
+        super().init(params)
+        self.wheel = palette.wheel(self.brightness, self.fb.order)
+
+    def render(self, fb, t):
+        fb.fill(self.wheel, t & 255)  # Set all LEDs to the same color
+
+class TheatreChase(Effect):
+    def __init__(self, fb):
+        super().__init__(fb)
+        # Every third LED lit, with two spare pixels so any phase is a plain copy
+        self.pattern = FrameBuffer(bytearray((fb.n + 2) * fb.bpp), fb.n + 2, fb.bpp, fb.order)
+
+    @classmethod
+    def state_bytes(cls, n, bpp):
+        return (n + 2) * bpp
+
+    def init(self, params):
+        super().init(params)
+        px = self.fb.pack(palette.scale(self.color, self.brightness))
+        for i in range(0, self.pattern.n, 3):
+            self.pattern.set(i, px)
+
+    def render(self, fb, t):
+        # Three steps in the chase pattern, every third LED from t % 3 on
+        fb.blit(self.pattern.buf, src_start=(3 - t % 3) % 3)
+
+class FadeInOut(Effect):
+    # Rises to full and falls back over period frames along a table from
+    # easing.py: params["curve"] if given, else the class's own curve. The
+    # speed setting paces the frames, so one breath lasts period * speed ms
+    curve = easing.LINEAR
+    period = 202
+
+    def init(self, params):
+        super().init(params)
+        self.ramp = palette.ramp(self.color, self.brightness, self.fb.order)
+        self.table = params.get("curve") or self.curve
+
+    def render(self, fb, t):
+        fb.fill(self.ramp, easing.ease(self.table, easing.triangle(t, self.period)))
+
+class ColorWipe(Effect):
+    def init(self, params):
+        super().init(params)
+        self.px = self.fb.pack(palette.scale(self.color, self.brightness))
+
+    def render(self, fb, t):
+        n = fb.n
+        step = t % (2 * n)
+        if step < n:
+            # Wipe forward
+            fb.fill(self.px, count=step + 1)
+            fb.fill(fb.black, start=step + 1)
+        else:
+            # Clear LEDs
+            step -= n
+            fb.fill(fb.black, count=step + 1)
+            fb.fill(self.px, start=step + 1)
+
+class Breathe(FadeInOut):
+    curve = easing.SINE
+
+class Sparkle(Effect):
+    sparkles = 8  # New sparkles per frame for every 180 LEDs
+    fade = 200  # Intensity kept per frame, out of 256
+
+    def __init__(self, fb):
+        super().__init__(fb)
+        # Every LED has an intensity that sparkles set to full and every
+        # frame scales down, drawn through a colour ramp. New sparkles come
+        # from pool, a permutation of the LED indexes shuffled a step at a
+        # time (Fisher-Yates), so an LED is not picked twice before every
+        # other LED has been, and picking never retries
+        n = fb.n
+        self.level = bytearray(n)
+        self.pool = array("H", range(n))
+        self.next = 0  # Pool entries before next were handed out this round
+        self.spawn = max(1, self.sparkles * n // 180)
+        self.rand = bytearray(2 * self.spawn)
+        self.state = random_state()
+        self.last = -1
+
+    @classmethod
+    def state_bytes(cls, n, bpp):
+        return 3 * n + 4 + 2 * max(1, cls.sparkles * n // 180)
+
+    def init(self, params):
+        super().init(params)
+        self.ramp = palette.ramp(self.color, self.brightness, self.fb.order)
+
+    def render(self, fb, t):
+        level = self.level
+        n = len(level)
+        if t <= self.last or self.last < 0:
+            kernels.scale_buf(level, n, 0)  # Restarted, all dark
+        else:
+            # Fade once per elapsed frame
+            for _ in range(min(t - self.last, 8)):
+                kernels.scale_buf(level, n, self.fade)
+        self.last = t
+
+        pool = self.pool
+        rand = self.rand
+        k = self.next
+        kernels.rand_fill(rand, len(rand), self.state)
+        for o in range(0, len(rand), 2):
+            if k == n:
+                k = 0
+            j = k + ((rand[o] | rand[o + 1] << 8) * (n - k) >> 16)
+            i = pool[j]
+            pool[j] = pool[k]
+            pool[k] = i
+            level[i] = 255
+            k += 1
+        self.next = k
+
+        fb.lookup(self.ramp, level)
+
+class Fire(Effect):
+    cooldown = 55
+    heat_increment = 40
+    flame_length = 180  # Longest flame; longer strips get mirrored flames and more spark origins
+
+    def __init__(self, fb):
+        super().__init__(fb)
+        # Strips longer than one flame burn from both ends towards the
+        # middle, the second half mirroring the first, and each half gets a
+        # spark origin per flame_length LEDs
+        n = fb.n
+        self.mirrored = n > self.flame_length
+        cells = (n + 1) // 2 if self.mirrored else n
+        count = (cells + self.flame_length - 1) // self.flame_length
+        self.heat = bytearray(cells)  # Heat of each LED, kept across mode switches
+        self.origins = tuple(k * cells // count for k in range(count))
+        self.sparks = bytearray(3 * count)  # Chance, offset and heat of a spark per origin
+        self.state = random_state()
+        self.cool = self.cooldown * 10 // (cells // count) + 2
+
+    @classmethod
+    def state_bytes(cls, n, bpp):
+        return n + 4 + 3 * ((n + cls.flame_length - 1) // cls.flame_length)
+
+    def init(self, params):
+        super().init(params)
+        self.colors = palette.heat(self.brightness, self.fb.order)
+
+    def render(self, fb, t):
+        heat = self.heat
+        n = len(heat)
+
         # Step 1: Cool down every cell a little
-        for i in range(NUM_LEDS):
-            cooldown_amount = random.randint(0, ((cooldown * 10) // NUM_LEDS) + 2)
-            heat[i] = max(0, heat[i] - cooldown_amount)
+        kernels.heat_cool(heat, n, self.cool, self.state)
 
         # Step 2: Heat drifts upward
-        for i in range(NUM_LEDS - 1, 1, -1):
-            heat[i] = (heat[i - 1] + heat[i - 2] + heat[i - 2]) // 3
-
-        # Step 3: Ignite new sparks near the bottom
-        if random.randint(0, 255) < heat_increment:
-            spark_index = random.randint(0, 7)
-            heat[spark_index] = min(255, heat[spark_index] + random.randint(160, 255))
-
-        # Step 4: Map heat to color with brightness adjustment and display
-        for i in range(NUM_LEDS):
-            base_color = heat_to_color(heat[i])
-            adjusted_color = tuple(int(c * brightness) for c in base_color)
-            np[i] = adjusted_color
-        np.write()
-
-        # Control flame animation speed
-        await asyncio.sleep_ms(speed)
-
-def heat_to_color(heat):
-    # Convert heat values to color (red-yellow-white gradient)
-    if heat <= 85:
-        return (heat * 3, 0, 0)  # Red tones
-    elif heat <= 170:
-        return (255, (heat - 85) * 3, 0)  # Yellow tones
-    else:
-        return (255, 255, (heat - 170) * 3)  # White tones
-    
-async def meteor_rain(color, brightness=100, meteor_size=15, trail_decay=0.7, speed=50):
-    brightness = max(0, min(brightness, 100)) / 100  # Normalize brightness to 0-1 scale
-    adjusted_color = tuple(int(c * brightness) for c in color)  # Adjust color for brightness
-
-    while True:
-        # Clear LEDs
-        np.fill((0, 0, 0))
-
-        # Move the meteor across the strip
-        for start in range(NUM_LEDS + meteor_size):
-            # Fade all LEDs slightly to create trailing effect
-            for i in range(NUM_LEDS):
-                np[i] = tuple(int(c * trail_decay) for c in np[i])
-            
-            # Set the LEDs for the meteor
-            for j in range(meteor_size):
-                if 0 <= start - j < NUM_LEDS:
-                    np[start - j] = adjusted_color
-
-            np.write()
-            await asyncio.sleep_ms(speed)
+        kernels.heat_diffuse(heat, n)
+
+        # Step 3: Ignite new sparks near the bottom of every flame
+        sparks = self.sparks
+        kernels.rand_fill(sparks, len(sparks), self.state)
+        o = 0
+        for origin in self.origins:
+            if sparks[o] < self.heat_increment:
+                i = origin + (sparks[o + 1] & 7)
+                if i < n:
+                    v = heat[i] + 160 + (sparks[o + 2] * 96 >> 8)
+                    heat[i] = v if v < 256 else 255
+            o += 3
+
+        # Step 4: Map heat to brightness-scaled color
+        fb.lookup(self.colors, heat)
+        if self.mirrored:
+            kernels.mirror(fb.buf, fb.n, fb.bpp)
+
+class MeteorRain(Effect):
+    meteor_size = 15
+    trail_decay = 179  # 0.7 * 256
+
+    def __init__(self, fb):
+        super().__init__(fb)
+        self.trail = FrameBuffer(bytearray(fb.size), fb.n, fb.bpp, fb.order)
+        self.last = -1
+
+    @classmethod
+    def state_bytes(cls, n, bpp):
+        return n * bpp
+
+    def init(self, params):
+        super().init(params)
+        self.px = self.fb.pack(palette.scale(self.color, self.brightness))
+        self.last = -1
+
+    def render(self, fb, t):
+        trail = self.trail
+        # Move the meteor across the strip, clearing LEDs at every pass
+        start = t % (fb.n + self.meteor_size)
+        if start <= self.last or self.last < 0:
+            trail.clear()
+
+        # Fade all LEDs slightly to create trailing effect, once per elapsed frame
+        for _ in range(min(start - self.last, 8) if start > self.last >= 0 else 1):
+            trail.scale(self.trail_decay)
+        self.last = start
+
+        # Set the LEDs for the meteor
+        trail.fill(self.px, start=start - self.meteor_size + 1, count=self.meteor_size)
+        fb.blit(trail.buf)
+
+class Stream(Effect):
+    """Shows pixel frames sent by the host over BLE."""
+    # Packets start with magic, opcode and a little-endian uint16 argument:
+    #   PIXELS: r, g, b bytes for the pixels from index argument on
+    #   RUNS:   (index uint16, count, r, g, b) runs filling count pixels each
+    #   COMMIT: show the frame built so far; the argument is a frame number
+    #           that increments by one per frame and exposes lost commits
+    # Pixels are drawn into a back buffer, copied to the front one on commit
+    # and latched from there, so a frame is never shown half written.
+    animated = False
+    MAGIC = 0xA6
+    PIXELS = 0x01
+    RUNS = 0x02
+    COMMIT = 0x03
+
+    def __init__(self, fb):
+        super().__init__(fb)
+        self.back = FrameBuffer(bytearray(fb.size), fb.n, fb.bpp, fb.order)
+        self.front = bytearray(fb.size)
+        self.px = bytearray(fb.bpp)
+        self.seq = None
+        self.pending = False  # Committed but not rendered yet
+        self.frames = 0  # Frames committed
+        self.dropped = 0  # Frames lost before they were shown
+        self.bytes = 0  # Stream bytes received
+
+    @classmethod
+    def state_bytes(cls, n, bpp):
+        return (2 * n + 1) * bpp
+
+    def init(self, params):
+        super().init(params)
+        self.seq = None
+
+    def receive(self, data):
+        # Called from the BLE IRQ with one packet; True when it commits a frame
+        n = len(data)
+        self.bytes += n
+        if n < 4:
+            return False
+        op = data[1]
+        arg = data[2] | data[3] << 8
+        back = self.back
+        if op == self.PIXELS:
+            back.put_rgb(memoryview(data)[4:], start=arg)
+        elif op == self.RUNS:
+            px = self.px
+            order = back.order
+            for o in range(4, n - 5, 6):
+                px[order[0]] = data[o + 3]
+                px[order[1]] = data[o + 4]
+                px[order[2]] = data[o + 5]
+                back.fill(px, start=data[o] | data[o + 1] << 8, count=data[o + 2])
+        elif op == self.COMMIT:
+            if self.seq is not None:
+                self.dropped += (arg - self.seq - 1) & 0xFFFF
+            if self.pending:
+                self.dropped += 1  # Replaced before the render task showed it
+            self.seq = arg
+            self.frames += 1
+            self.front[:] = back.buf
+            self.pending = True
+            return True
+        return False
+
+    def render(self, fb, t):
+        fb.blit(self.front)
+        self.pending = False
+
+PATTERNS = {
+    "off": Off,
+    "on": Solid,
+    "color": Solid,
+    "rainbow": Rainbow,
+    "rainbow_cycle": RainbowCycle,
+    "rainbow_solid": RainbowSolid,
+    "theatre_chase": TheatreChase,
+    "fade_in_out": FadeInOut,
+    "color_wipe": ColorWipe,
+    "breathe": Breathe,
+    "sparkle": Sparkle,
+    "fire": Fire,
+    "meteor_rain": MeteorRain,
+    "stream": Stream,
+}
 
 def color_fill(color, brightness=100):
-    adjusted_brightness = max(0, min(brightness, 100)) / 100  # Clamp brightness to 0-100 and normalize
-    adjusted_color = tuple(int(c * adjusted_brightness) for c in color)
-    np.fill(adjusted_color)
+    fb.fill(fb.pack(palette.scale(color, brightness)))
     np.write()
 
 def leds_off():
-    np.fill((0, 0, 0))
+    fb.clear()
     np.write()
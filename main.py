@@ -1,13 +1,42 @@
-import binascii, micropython
+# Boot is staged so the strip lights up as early as possible: only the
+# strip and a minimal settings reader are imported before the saved static
+# mode is shown, and the effects, BLE and the rest come after. Every stage is
+# timed in BOOT_TRACE (microseconds since main.py started), printed once the
+# effect is selected and also shown by the info command.
+import time
+BOOT_US = time.ticks_us()
+BOOT_TRACE = []
+
+def boot_trace(stage):
+    BOOT_TRACE.append((stage, time.ticks_diff(time.ticks_us(), BOOT_US)))
+
+def format_boot_trace():
+    return ", ".join("{} {} us".format(stage, us) for stage, us in BOOT_TRACE)
+
+import gc, micropython, strip
+from settings import DEFAULT_SETTINGS, read_saved
+
+if __name__ == "__main__":
+    boot_saved = [read_saved(i) for i in range(len(strip.segments))]
+    boot_trace("settings read")
+    for i, values in enumerate(boot_saved):
+        strip.restore(values or DEFAULT_SETTINGS, i)
+    boot_trace("strip restored")
+
+import easing
 import led_patterns
 import uasyncio as asyncio
 from ble_uart import BLEUART
 from machine import Pin
-from settings import SETTINGS_FILE, DEFAULT_SETTINGS, load_settings, save_settings, hash_settings
+from renderer import Renderer
+from settings import CURVE_NAMES, SETTINGS_FILE, SettingsStore, load_settings, default_digest, read_layout, save_layout, load_program
 from threadsafe_queue import ThreadSafeQueue
 
+boot_trace("modules imported")
+
 BLE_NAME = "ESP32-C3 Neopixels"
 LED_INDICATOR_PIN = 3
+AUTOSAVE_SECONDS = 0  # Save changed settings after this long without commands, 0 to only save on request
 
 # Mode constants
 MODE_ON = "on"
@@ -23,6 +52,8 @@ MODE_BREATHE = "breathe"
 MODE_SPARKLE = "sparkle"
 MODE_FIRE = "fire"
 MODE_METEOR_RAIN = "meteor_rain"
+MODE_STREAM = "stream"
+MODE_PLAY = "play"  # Loops the program, see COMMAND_STEP
 
 # Tuple of all modes
 MODES = (
@@ -39,6 +70,8 @@ MODES = (
     MODE_SPARKLE,
     MODE_FIRE,
     MODE_METEOR_RAIN,
+    MODE_STREAM,
+    MODE_PLAY,
 )
 
 EFFECTS = (
@@ -52,6 +85,7 @@ EFFECTS = (
     MODE_SPARKLE,
     MODE_FIRE,
     MODE_METEOR_RAIN,
+    MODE_STREAM,
 )
 
 COLOR_REQUIRED = (
@@ -75,39 +109,191 @@ COMMANDS = (
     COMMAND_INFO
 )
 
+# "segment N" makes the commands after it (in the same message and later
+# ones) apply to segment N of the strips, counting from 1; see strip.py
+COMMAND_SEGMENT = "segment"
+
+# "strip PIN LEDS [ORDER] [LEDS ...]" adds or replaces the strip on PIN, with
+# the colour order one of strip.ORDERS (grb by default) and optionally split
+# into segments of the given lengths; 0 LEDs removes it. The layout is saved
+# and used from the next boot on.
+COMMAND_STRIP = "strip"
+
+# "curve NAME" sets the easing curve fade_in_out and breathe rise and fall
+# along, one of settings.CURVE_NAMES; "default" is linear for fade_in_out and
+# sine for breathe. The speed setting paces them, so it sets the period too.
+COMMAND_CURVE = "curve"
+
+# "step MODE COLOR BRIGHTNESS SPEED DURATION [TRANSITION [CURVE]]" adds a step
+# to the program that the play mode loops on the device: MODE as the mode
+# command, COLOR a colour name, "r,g,b" or "-", then brightness in %, speed,
+# how long the step shows and how long it fades in, both in ms, and the
+# curve as the curve command. "steps" lists the
+# program and "steps clear" empties it. The program is saved with the
+# settings, so a saved play mode resumes it at boot.
+COMMAND_STEP = "step"
+COMMAND_STEPS = "steps"
+
+# "stats" replies with one line of performance counters, "stats N" repeats it
+# every N seconds and "stats 0" stops that
+COMMAND_STATS = "stats"
+
+# Binary frames (see ble_uart.BINARY_FRAME) carry an opcode that is either a
+# mask of the fields to set or FRAME_COMMAND, which runs COMMANDS[mode id]
+FRAME_SET_MODE = 0x01  # MODES[mode id]
+FRAME_SET_COLOR = 0x02  # (r, g, b)
+FRAME_SET_BRIGHTNESS = 0x04
+FRAME_SET_SPEED = 0x08
+FRAME_COMMAND = 0x80
+
+# One message may carry several commands, e.g. "fire;80%;30", separated by
+# ";" or newlines. They are handled in order, the effect is switched once at
+# the end and every reply goes out in a single notification.
+COMMAND_SEPARATOR = ";"
+
 class BleLedController:
-    def __init__(self):
+    def __init__(self, settings=None):
+        # settings: a Settings per segment, loaded here if not given
         self.led = Pin(LED_INDICATOR_PIN, Pin.OUT)
         self.led.off()
-        self.settings = load_settings()
-        self.settings_hash = hash_settings(self.settings)
-        self.ble_message_queue = ThreadSafeQueue(3)
+        self.segment_settings = settings or [load_settings(segment=i) for i in range(len(strip.segments))]
+        self.segment = 0  # Segment that commands apply to
+        self.settings = self.segment_settings[0]
+        self.apply_needed = False  # The batch changed the settings of self.segment
+        self.program = load_program()
+        self.store = SettingsStore(self.segment_settings, self.settings_saved, autosave_s=AUTOSAVE_SECONDS,
+                                   program=self.program)
+        self.ble_message_queue = ThreadSafeQueue(8)  # Lengths of messages in the BLE RX ring
         self.ble = BLEUART(name=BLE_NAME, queue=self.ble_message_queue, led=self.led)
         self.last_ble_command = None
         self.is_change = False
+        self.command_ms = None  # ticks_ms at which the command being handled arrived
+        self.blink_task = None
+        self.stream_task = None
+        self.stream_segment = None  # Segment in stream mode, if any
+        self.stats_task = None
+        self.replies = None  # Notifications collected while a batch is handled
+        self.renderer = Renderer(strip.strips, strip.segments, led_patterns.PATTERNS)
+        gc.collect()
+        self.renderer.plan(gc.mem_free() - strip.HEAP_RESERVE)
     
     def notify(self, msg):
-        self.ble.write(msg)
+        if self.replies is None:
+            self.ble.write(msg)
+        else:
+            self.replies.append(msg)
+
+    def parse_batch(self, msg):
+        # Returns True if any command in the batch changed the settings
+        if isinstance(msg, tuple):
+            is_change = self.apply_needed = self.parse_frame(msg)
+            if self.settings.mode in COMMANDS:
+                self.run_command()
+            return is_change
+
+        is_change = self.apply_needed = False
+        for cmd in msg.replace("\n", COMMAND_SEPARATOR).split(COMMAND_SEPARATOR):
+            cmd = cmd.strip()
+            if not cmd:
+                continue
+            if cmd.lower().startswith(COMMAND_SEGMENT):
+                # Changes so far belong to the segment being left
+                if self.apply_needed:
+                    self.apply_settings()
+                    self.apply_needed = False
+                self.select_segment(cmd[len(COMMAND_SEGMENT):].strip())
+                continue
+            if self.parse_command(cmd):
+                is_change = self.apply_needed = True
+            if self.settings.mode in COMMANDS:
+                # Run it now so later settings in the batch apply on top
+                self.run_command()
+        return is_change
+
+    def select_segment(self, arg):
+        try:
+            segment = int(arg) - 1
+        except ValueError:
+            segment = -1
+        count = len(self.segment_settings)
+        if not 0 <= segment < count:
+            self.notify("Segment must be between 1 and {}.".format(count))
+            return
+        self.segment = segment
+        self.settings = self.segment_settings[segment]
+        self.notify("Segment {} of {}.".format(segment + 1, count))
     
+    def parse_frame(self, frame):
+        # Returns True if the binary frame changed the settings
+        _, op, mode_id, r, g, b, brightness, speed = frame
+        settings = self.settings
+
+        if op == FRAME_COMMAND:
+            if mode_id < len(COMMANDS):
+                return self.parse_command(COMMANDS[mode_id])
+            self.notify("Unknown command.")
+            return False
+
+        if op & FRAME_SET_MODE and mode_id >= len(MODES):
+            self.notify("Unknown mode or settings error.")
+            return False
+        if op & FRAME_SET_BRIGHTNESS and brightness > 100:
+            self.notify("Brightness value must be between 0% and 100%.")
+            return False
+        if op & FRAME_SET_SPEED and not 20 <= speed <= 1000:
+            self.notify("Speed value must be between 20 and 1000.")
+            return False
+
+        is_change = False
+        if op & FRAME_SET_MODE and settings.set("mode", MODES[mode_id]):
+            is_change = True
+        # A colour is stored as a list to round-trip through JSON
+        if op & FRAME_SET_COLOR and settings.set("color", [r, g, b]):
+            is_change = True
+        if op & FRAME_SET_BRIGHTNESS and settings.set("brightness", brightness):
+            is_change = True
+        if op & FRAME_SET_SPEED and settings.set("speed", speed):
+            is_change = True
+        return is_change
+
     def parse_command(self, cmd):
         cmd = cmd.lower()
         
+        if cmd.startswith(COMMAND_STATS):
+            self.stats_command(cmd[len(COMMAND_STATS):].strip())
+            return False
+
+        if cmd.startswith(COMMAND_STRIP):
+            self.strip_command(cmd[len(COMMAND_STRIP):].strip())
+            return False
+
+        if cmd.startswith(COMMAND_CURVE):
+            curve = cmd[len(COMMAND_CURVE):].strip()
+            if curve not in CURVE_NAMES:
+                self.notify("Unknown curve, use one of: {}.".format(", ".join(CURVE_NAMES)))
+                return False
+            self.settings.set("curve", curve)
+            self.notify("Curve set to {}".format(curve))
+            return True
+
+        if cmd.startswith(COMMAND_STEPS):
+            return self.steps_command(cmd[len(COMMAND_STEPS):].strip())
+
+        if cmd.startswith(COMMAND_STEP):
+            return self.step_command(cmd[len(COMMAND_STEP):].strip())
+
         if cmd in COMMANDS:
-            old_mode = self.settings["mode"]
-            is_change = old_mode != cmd
-            self.settings["mode"] = cmd 
-            self.settings["old-mode"] = old_mode
-            return is_change
+            old_mode = self.settings.mode
+            self.settings.old_mode = old_mode
+            return self.settings.set("mode", cmd)
             
         if cmd in MODES:
-            is_change = self.settings["mode"] != cmd
-            self.settings["mode"] = cmd
-            return is_change
+            return self.settings.set("mode", cmd)
 
         if cmd in led_patterns.COLORS:
-            is_change = self.settings["mode"] != cmd
-            self.settings["mode"] = MODE_COLOR
-            self.settings["color"] = cmd
+            is_change = self.settings.mode != cmd
+            self.settings.set("mode", MODE_COLOR)
+            self.settings.set("color", cmd)
             return is_change
         
         # Check if cmd is a brightness value (0% to 100%)
@@ -115,7 +301,7 @@ class BleLedController:
             try:
                 val = int(cmd[:-1].strip())  # Remove '%' and convert to integer
                 if 0 <= val <= 100:
-                    self.settings["brightness"] = val
+                    self.settings.set("brightness", val)
                     self.notify(f"Brightness set to {val}%")
                     return True
                 else:
@@ -129,7 +315,7 @@ class BleLedController:
         try:
             val = int(cmd.strip())  # Convert to integer directly
             if 20 <= val <= 1000:
-                self.settings["speed"] = val
+                self.settings.set("speed", val)
                 self.notify(f"Speed set to {val}")
                 return True
             else:
@@ -142,39 +328,174 @@ class BleLedController:
         return False
     
     def is_settings_change(self):
-        current_settings_hash = hash_settings(self.settings)
-        return current_settings_hash != self.settings_hash
+        for settings in self.segment_settings:
+            if not settings.is_saved():
+                return True
+        return False
+
+    def stats_command(self, arg):
+        if not arg:
+            self.send_stats()
+            return
+        try:
+            interval = int(arg)
+        except ValueError:
+            self.notify("Unknown command.")
+            return
+        if self.stats_task is not None:
+            self.stats_task.cancel()
+            self.stats_task = None
+        if interval > 0:
+            self.stats_task = asyncio.create_task(self.report_stats(interval))
+
+    def strip_command(self, arg):
+        words = arg.split()
+        order = "grb"
+        if len(words) > 2 and words[2] in strip.ORDERS:
+            order = words.pop(2)
+        try:
+            pin, n, *sizes = [int(word) for word in words]
+        except ValueError:
+            self.notify("Usage: strip PIN LEDS [ORDER] [LEDS ...]")
+            return
+
+        # Edit the layout saved last, which may not be the one running yet
+        strips, segments = read_layout() or (strip.STRIPS, strip.SEGMENTS)
+        strips = [s for s in strips if s[0] != pin]
+        segments = [s for s in segments if s[0] != pin]
+        if n:
+            strips.append((pin, n, order))
+            start = 0
+            for size in sizes or (n,):
+                segments.append((pin, start, size))
+                start += size
+        # The buffers of the current layout are freed by the restart
+        error = strip.check_layout(strips, segments, gc.mem_free() + strip.pixel_bytes(strip.STRIPS))
+        if error:
+            self.notify("Layout refused: {}.".format(error))
+            return
+        save_layout(strips, segments)
+        self.notify("Layout saved, restart to apply: {} {}".format(strips, segments))
+
+    def step_command(self, arg):
+        # Returns True if the play mode has to restart with the new program
+        words = arg.split()
+        try:
+            mode, color = words[0], words[1]
+            brightness, speed, duration = int(words[2]), int(words[3]), int(words[4])
+            transition = int(words[5]) if len(words) > 5 else 0
+            curve = words[6] if len(words) > 6 else "default"
+            if "," in color:
+                color = [int(c) for c in color.split(",")]
+        except (IndexError, ValueError):
+            self.notify("Usage: step MODE COLOR BRIGHTNESS SPEED DURATION [TRANSITION [CURVE]]")
+            return False
+        if color == "-":
+            color = "white"
+        if mode not in MODES or mode in (MODE_STREAM, MODE_PLAY):
+            self.notify("Unknown mode or settings error.")
+        elif not (len(color) == 3 and all(0 <= c <= 255 for c in color) if isinstance(color, list)
+                  else color in led_patterns.COLORS):
+            self.notify("Unknown colour.")
+        elif not 0 <= brightness <= 100:
+            self.notify("Brightness value must be between 0% and 100%.")
+        elif not 20 <= speed <= 1000:
+            self.notify("Speed value must be between 20 and 1000.")
+        elif curve not in CURVE_NAMES:
+            self.notify("Unknown curve, use one of: {}.".format(", ".join(CURVE_NAMES)))
+        elif not 0 < duration < 1 << 32 or not 0 <= transition < 1 << 16 or len(self.program.steps) >= 255:
+            self.notify("Duration or transition out of range, or too many steps.")
+        else:
+            self.program.add({"mode": mode, "color": color, "brightness": brightness, "speed": speed,
+                              "curve": curve}, duration, transition)
+            self.notify("Step {} added.".format(len(self.program.steps)))
+            return self.settings.mode == MODE_PLAY
+        return False
+
+    def steps_command(self, arg):
+        if arg == "clear":
+            self.program.clear()
+            self.notify("Program cleared.")
+            return self.settings.mode == MODE_PLAY
+        if arg:
+            self.notify("Unknown command.")
+            return False
+        lines = ["{}: {} {} {}% {} {} for {} ms, fade {} ms".format(
+            i + 1, values["mode"], values["color"], values["brightness"], values["speed"], values["curve"],
+            duration, transition)
+            for i, (values, duration, transition) in enumerate(self.program.steps)]
+        self.notify("\n".join(lines) or "No program steps.")
+        return False
+
+    async def report_stats(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.send_stats()
+
+    def send_stats(self):
+        # Frame timings are min/avg/max in us since the previous report,
+        # writes the strip writes done/skipped as unchanged since boot
+        scheduler = self.renderer.scheduler
+        scheduler.heap.sample()
+        queue = self.ble_message_queue
+        self.notify("fps {}/{} render {} write {} us writes {}/{} heap {} free gc {} queue {}/{} drop {} rx {} tx {}".format(
+            scheduler.fps, scheduler.target_fps(),
+            scheduler.render_time.format(), scheduler.write_time.format(),
+            scheduler.writes, scheduler.unchanged,
+            gc.mem_free(), scheduler.heap.collections,
+            queue.high, queue.capacity, queue.dropped,
+            self.ble.rx_bytes, self.ble.tx_bytes))
+        scheduler.render_time.reset()
+        scheduler.write_time.reset()
+
+    def settings_saved(self, written, error):
+        if error is not None:
+            self.notify("Settings not saved: {}.".format(error))
+        else:
+            self.notify("Settings saved." if written else "Settings already saved.")
 
     def send_current_settings(self):
-        mode = self.settings.get("mode")
-        color = self.settings.get("color")
-        brightness = self.settings.get("brightness")
-        speed = self.settings.get("speed")
+        settings = self.settings
+        mode = settings.mode
+        color = settings.color
+        brightness = settings.brightness
+        speed = settings.speed
+        curve = settings.curve
 
+        if len(self.segment_settings) > 1:
+            self.notify("Segment: {}".format(self.segment + 1))
         msg = """
 Mode: {}
 Color: {}
 Brightness: {}
 Speed: {}
+Curve: {}
 """.format(
-            mode, color, brightness, speed
+            mode, color, brightness, speed, curve
         ).strip()
         self.notify(msg)
 
     def send_info(self):
-        default_settings_hash = binascii.hexlify(hash_settings(DEFAULT_SETTINGS))
+        import binascii
+        default_settings_hash = binascii.hexlify(default_digest())
 
-        current_settings = self.settings
-        current_settings_hash = binascii.hexlify(hash_settings(current_settings))
+        current_settings = self.settings.as_dict()
+        current_settings_hash = binascii.hexlify(self.settings.digest())
 
-        saved_settings = load_settings()
-        saved_settings_hash = binascii.hexlify(hash_settings(current_settings))
+        saved_settings = self.settings.saved
+        saved_digest = self.settings.saved_digest
+        saved_settings_hash = saved_digest and binascii.hexlify(saved_digest)
+        scheduler = self.renderer.scheduler
 
         info = {
             "Bluetooth name": BLE_NAME,
-            "Number of LEDs": led_patterns.NUM_LEDS,
+            "Number of LEDs": strip.NUM_LEDS,
+            "Strips (pin, LEDs, order)": strip.STRIPS,
+            "Segments (pin, first LED, LEDs)": strip.SEGMENTS,
+            "Saved layout refused": strip.layout_error or "No",
+            "Modes without memory": ", ".join(self.renderer.segments[self.segment].refused) or "None",
             "Indicator LED pin": LED_INDICATOR_PIN,
-            "Neopixel LEDs pin": led_patterns.NEOPIXEL_LEDS_PIN,
+            "Neopixel LEDs pin": strip.NEOPIXEL_LEDS_PIN,
             "Settings file": SETTINGS_FILE,
             "Default settings": DEFAULT_SETTINGS,
             "Default settings hash": default_settings_hash,
@@ -183,8 +504,16 @@ Speed: {}
             "Saved settings": saved_settings,
             "Saved settings hash": saved_settings_hash,
             "Need to save new settings?": "Yes" if self.is_settings_change() else "No",
+            "Settings writes/skipped/failed": "{}/{}/{}".format(self.store.writes, self.store.skipped, self.store.failed),
+            "Program steps": "{}{}".format(len(self.program.steps), "" if self.program.saved else " (not saved)"),
             "Last recieved BLE command": self.last_ble_command,
-            "Last BLE command changed current settings?": "Yes" if self.is_change else "No"
+            "Last BLE command changed current settings?": "Yes" if self.is_change else "No",
+            "Frame rate (actual/target)": "{}/{} FPS".format(scheduler.fps, scheduler.target_fps()),
+            "Frames written/skipped": "{}/{}".format(scheduler.frames, scheduler.skipped),
+            "Strip writes done/unchanged": "{}/{}".format(scheduler.writes, scheduler.unchanged),
+            "BLE bytes/messages/dropped": "{}/{}/{}".format(self.ble.rx_bytes, self.ble.rx_messages, self.ble.rx_dropped),
+            "Boot trace": format_boot_trace(),
+            "Command to first frame": "n/a" if self.renderer.latency_ms is None else "{} ms".format(self.renderer.latency_ms),
         }
 
         for k, v in info.items():
@@ -193,33 +522,29 @@ Speed: {}
             
     def restore_old_mode_or(self, mode):
         # Restore the previous mode if "old-mode" exists
-        if "old-mode" in self.settings:
-            old_mode = self.settings["old-mode"]
-            self.settings["mode"] = old_mode
-            del self.settings["old-mode"]  # Remove "old-mode" from settings
+        if self.settings.old_mode is not None:
+            old_mode = self.settings.old_mode
+            self.settings.set("mode", old_mode)
+            self.settings.old_mode = None
             self.notify(f"Mode restored to {old_mode}.")
             return old_mode
         else:
             return mode
     
-    async def neopixels(self):
-        mode = self.settings.get("mode")
-        color = self.settings.get("color")
-        color_rgb = led_patterns.COLORS.get(color)
-        brightness = self.settings.get("brightness")
-        speed = self.settings.get("speed")
-        
-        led_patterns.leds_off()
+    def run_command(self):
+        # Carry out a command stored in the mode setting and return the mode
+        # to display afterwards
+        mode = self.settings.mode
         
         if mode == COMMAND_SAVE:
             mode = self.restore_old_mode_or(mode)
-            save_settings(self.settings)
-            self.notify("Settings saved.")
+            self.store.save()  # Written once commands have been quiet for a moment
 
         elif mode == COMMAND_RESET:
-            self.settings = DEFAULT_SETTINGS.copy()
-            self.settings_hash = hash_settings(self.settings)
+            self.settings.update(DEFAULT_SETTINGS)
+            self.settings.old_mode = None
             self.notify("Reset to default settings.")
+            mode = self.settings.mode
             
         elif mode == COMMAND_MODE:
             mode = self.restore_old_mode_or(mode)
@@ -228,69 +553,141 @@ Speed: {}
         elif mode == COMMAND_INFO:
             mode = self.restore_old_mode_or(mode)
             self.send_info()
-        
-        if mode == MODE_OFF:
-            led_patterns.leds_off()
-        
-        elif mode == MODE_ON:
-            led_patterns.color_fill(led_patterns.COLORS["white"], brightness)
 
-        elif mode == MODE_COLOR and color in led_patterns.COLORS.keys():
-            color = color_rgb
-            led_patterns.color_fill(color, brightness)
-            
-        elif mode in EFFECTS:
-            # Check if color is required and use default if not specified
-            color = color_rgb if mode in COLOR_REQUIRED else None
-            # Retrieve the function dynamically from led_patterns and call with required params
-            effect_func = getattr(led_patterns, mode)
-            
-            # Call effect with brightness and color if required
-            if color:
-                await effect_func(color=color, brightness=brightness, speed=speed)
+        return mode
+
+    def effect_params(self, mode, color, brightness, speed, curve):
+        # The effect and its params for settings values, with the mode None if
+        # they are not valid. color is a colour name, or an [r, g, b] list set
+        # by a binary frame; curve one of CURVE_NAMES
+        color_rgb = led_patterns.COLORS.get(color) if isinstance(color, str) else color and tuple(color)
+
+        if mode == MODE_ON:
+            color_rgb = led_patterns.COLORS["white"]
+
+        elif mode == MODE_COLOR and color_rgb is None:
+            mode = None
+
+        elif mode in EFFECTS and mode not in COLOR_REQUIRED:
+            color_rgb = None
+
+        if mode in self.renderer.segments[self.segment].refused:
+            # Too long a segment for the effect's buffers, see Renderer.plan()
+            self.notify("Not enough memory for {} on this segment, showing a colour.".format(mode))
+            mode = MODE_COLOR
+
+        return mode, {"color": color_rgb, "brightness": brightness, "speed": speed,
+                      "curve": easing.CURVES.get(curve)}
+
+    def apply_settings(self):
+        mode = self.run_command()
+        settings = self.settings
+        if mode == MODE_PLAY:
+            program = []
+            for values, duration, transition in self.program.steps:
+                step_mode, params = self.effect_params(values["mode"], values["color"], values["brightness"],
+                                                       values["speed"], values["curve"])
+                if step_mode in led_patterns.PATTERNS:
+                    program.append((step_mode, params, duration, transition))
+            if program:
+                # The render task runs the show, without any command
+                self.renderer.play(program, self.command_ms, self.segment)
             else:
-                await effect_func(brightness=brightness, speed=speed)
-        
+                # Stop a program that was cleared while playing
+                self.renderer.select(MODE_OFF, {}, self.command_ms, self.segment)
+                self.notify("No program steps to play.")
         else:
-            self.notify("Unknown mode or settings error.")
+            mode, params = self.effect_params(mode, settings.color, settings.brightness, settings.speed,
+                                              settings.curve)
+            if mode in led_patterns.PATTERNS:
+                # Swap the effect drawn by the render task, which keeps running
+                self.renderer.select(mode, params, self.command_ms, self.segment)
+            else:
+                self.notify("Unknown mode or settings error.")
 
-        await asyncio.sleep(0)
+        if mode == MODE_STREAM:
+            # One segment streams at a time, the last one switched to it
+            self.stream_segment = self.segment
+            self.ble.stream = self.receive_stream
+            if self.stream_task is not None:
+                self.stream_task.cancel()
+            self.stream_task = asyncio.create_task(self.report_stream())
+        elif self.segment == self.stream_segment:
+            self.stream_segment = None
+            self.ble.stream = None
+            if self.stream_task is not None:
+                self.stream_task.cancel()
+                self.stream_task = None
+
+    def receive_stream(self, data):
+        # Pixel stream packet from the BLE IRQ, see led_patterns.Stream
+        if self.renderer.segments[self.stream_segment].effect.receive(data):
+            self.renderer.commit(self.stream_segment)
+
+    async def report_stream(self):
+        # Once a second while streaming: frames shown, frames lost and bytes
+        stream = self.renderer.segments[self.stream_segment].effect
+        frames, dropped, nbytes = stream.frames, stream.dropped, stream.bytes
+        while True:
+            await asyncio.sleep(1)
+            self.notify("Stream: {} FPS, {} dropped, {} B/s".format(
+                stream.frames - frames, stream.dropped - dropped, stream.bytes - nbytes))
+            frames, dropped, nbytes = stream.frames, stream.dropped, stream.bytes
     
+    async def blink(self, times):
+        # Indicator feedback, run beside command handling and cancelled by
+        # the next command; the LED is left on like a connected one
+        try:
+            for _ in range(times):
+                self.led.off()
+                await asyncio.sleep(0.3)
+                self.led.on()
+                await asyncio.sleep(0.3)
+        finally:
+            self.led.on()
+
     async def run(self):
-        neopixel_task = None
+        # Effects are drawn by their own task; this one sleeps until the BLE
+        # IRQ queues a message, so neither side polls
+        asyncio.create_task(self.renderer.run())
+        asyncio.create_task(self.ble.run())
+        asyncio.create_task(self.store.run())
+        for segment in range(len(self.segment_settings) - 1, -1, -1):
+            self.segment = segment
+            self.settings = self.segment_settings[segment]
+            self.apply_settings()
+        boot_trace("effect selected")
+        print("Boot: " + format_boot_trace())
         
-        while True:
-            if not self.ble_message_queue.empty():
-                # Await and process messages from the queue
-                msg = await self.ble_message_queue.get()
-                self.last_ble_command = msg
+        async for length in self.ble_message_queue:
+            msg = self.ble.take(length)
+            self.command_ms = time.ticks_ms()
+            self.last_ble_command = msg
+            self.replies = []
 
-                is_change = self.parse_command(msg)
-                self.is_change = is_change
-            
-                # Blink led 3 times if settings have changed
-                for _ in range(3 if self.is_change else 2):
-                    self.led.off()
-                    await asyncio.sleep(0.3)
-                    self.led.on()
-                    await asyncio.sleep(0.3)
-
-                if is_change:
-                    self.send_current_settings()
-                    
-                if neopixel_task is not None:
-                    neopixel_task.cancel()
-                    await asyncio.sleep(0)
-
-                neopixel_task = asyncio.create_task(self.neopixels())
-                
-            if neopixel_task is None:
-                neopixel_task = asyncio.create_task(self.neopixels())
-                
-            await asyncio.sleep(0)
+            is_change = self.parse_batch(msg)
+            self.is_change = is_change
+
+            if is_change:
+                self.store.changed()
+                self.send_current_settings()
+            if self.apply_needed:
+                # Queries such as stats leave the running effect alone
+                self.apply_settings()
+            self.command_ms = None
+
+            replies, self.replies = self.replies, None
+            if replies:
+                self.notify("\n".join(replies))
+
+            # Blink led 3 times if settings have changed
+            if self.blink_task is not None:
+                self.blink_task.cancel()
+            self.blink_task = asyncio.create_task(self.blink(3 if is_change else 2))
 
 if __name__ == "__main__":
     micropython.alloc_emergency_exception_buf(100)
     
-    ble_led_controller = BleLedController()
+    ble_led_controller = BleLedController([load_settings(values, i) for i, values in enumerate(boot_saved)])
+    boot_trace("BLE up")
     asyncio.run(ble_led_controller.run())
@@ -0,0 +1,24 @@
+# manifest.py Freeze the firmware modules into a custom MicroPython build
+#
+# Frozen modules are imported as bytecode (and, for kernels_viper, machine
+# code) straight from flash, so boot skips compiling them. main.py stays on
+# the file system; the modules below must then be removed from it, or the
+# copies there are imported instead. Build with e.g.
+#   make BOARD=ESP32_GENERIC_C3 FROZEN_MANIFEST=/path/to/manifest.py
+
+include("$(PORT_DIR)/boards/manifest.py")
+
+module("strip.py")
+module("settings.py")
+module("frame_buffer.py")
+module("kernels.py")
+module("kernels_viper.py")
+module("palette.py")
+module("easing.py")
+module("led_patterns.py")
+module("telemetry.py")
+module("scheduler.py")
+module("renderer.py")
+module("threadsafe_queue.py")
+module("ble_advertising.py")
+module("ble_uart.py")
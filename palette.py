@@ -0,0 +1,101 @@
+# palette.py Brightness-scaled colour lookup tables
+
+# Every table has 256 entries and is built once per (palette, brightness) pair.
+# Entries are packed in the strip's byte order (len(order) bytes each) so they
+# can be copied straight into a FrameBuffer. Effects index into them with plain
+# integers, so no per-pixel float maths or tuple building happens while a frame
+# is rendered. A table is only rebuilt when the brightness (or the ramp colour)
+# it was built for changes.
+
+COLORS = {
+    "black": (0, 0, 0),
+    "white": (255, 255, 255),
+    "red": (255, 0, 0),
+    "pink": (255, 20, 147),
+    "magenta": (255, 0, 255),
+    "purple": (128, 0, 128),
+    "blue": (0, 0, 255),
+    "cyan": (0, 255, 255),
+    "teal": (0, 128, 128),
+    "green": (0, 255, 0),
+    "yellow": (255, 255, 0),
+    "orange": (255, 165, 0),
+    "warm": (255, 223, 180)
+}
+
+WHEEL = "wheel"
+HEAT = "heat"
+RAMP = "ramp"
+
+GRB = (1, 0, 2)
+
+_tables = {}  # palette name -> (key, table)
+
+
+def level(brightness):
+    # Clamp a 0-100 % brightness
+    return max(0, min(brightness, 100))
+
+
+def scale(color, brightness):
+    b = level(brightness)
+    return (color[0] * b // 100, color[1] * b // 100, color[2] * b // 100)
+
+
+def color_wheel(pos):
+    if pos < 85:
+        return (pos * 3, 255 - pos * 3, 0)
+    elif pos < 170:
+        pos -= 85
+        return (255 - pos * 3, 0, pos * 3)
+    else:
+        pos -= 170
+        return (0, pos * 3, 255 - pos * 3)
+
+
+def heat_to_color(heat):
+    # Convert heat values to color (red-yellow-white gradient)
+    if heat <= 85:
+        return (heat * 3, 0, 0)  # Red tones
+    elif heat <= 170:
+        return (255, (heat - 85) * 3, 0)  # Yellow tones
+    else:
+        return (255, 255, (heat - 170) * 3)  # White tones
+
+
+def _build(name, key, fn, brightness, order):
+    key = (key, order)
+    entry = _tables.get(name)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+    _tables[name] = None  # Let the old table be collected before building
+    bpp = len(order)
+    b = level(brightness)
+    table = bytearray(256 * bpp)
+    for i in range(256):
+        c = fn(i)
+        o = i * bpp
+        table[o + order[0]] = c[0] * b // 100
+        table[o + order[1]] = c[1] * b // 100
+        table[o + order[2]] = c[2] * b // 100
+    _tables[name] = (key, table)
+    return table
+
+
+def wheel(brightness, order=GRB):
+    return _build(WHEEL, level(brightness), color_wheel, brightness, order)
+
+
+def heat(brightness, order=GRB):
+    return _build(HEAT, level(brightness), heat_to_color, brightness, order)
+
+
+def ramp(color, brightness, order=GRB):
+    # Entry i is color at i/255 of the requested brightness
+    r, g, b = color
+    return _build(RAMP, (r, g, b, level(brightness)),
+                  lambda i: (r * i // 255, g * i // 255, b * i // 255), brightness, order)
+
+
+def clear():
+    _tables.clear()
@@ -0,0 +1,263 @@
+# renderer.py Single long-lived render task driving the effect objects
+
+# Every segment of the strips (see strip.py) runs its own effect. Mode
+# switches only swap a segment's current effect object (see
+# led_patterns.Effect); the render task, the frame buffers and every effect's
+# own buffers are kept, so there is no task churn and no blank frame between
+# modes.
+#
+# One scheduler paces all segments at the shortest interval of the animated
+# ones. A segment's frame t is the number of its own intervals between its
+# select() and the slot being rendered, so segments of different speeds share
+# the task, and a segment is only drawn when its t moves on. Effects that are
+# not animated are drawn once when selected. Each strip is written once per
+# frame, and only if one of its segments was drawn; when nothing is animated
+# the task sleeps until the next select() instead of scheduling frames.
+# select() and commit() also cut short the wait for the next frame slot (see
+# FrameScheduler.wake), so a command shows within scheduler.WAKE_SLICE_MS
+# even behind an effect with a slow speed.
+#
+# select() may be given the ticks_ms at which the command behind it arrived;
+# the time from there until the first frame of the new effect is rendered is
+# kept in latency_ms.
+#
+# plan() gives every segment a share of the free heap, by LED count, for the
+# buffers of its effects (see led_patterns.Effect.state_bytes()). Modes that
+# do not fit a segment's share at all are listed in its refused; when a new
+# effect does not fit next to the ones already created for a segment, those
+# are dropped (and rebuilt on their next use) to make room.
+#
+# commit() may be called from an IRQ to have a static effect drawn and latched
+# again, which is how frames streamed by the host are shown.
+#
+# play() runs a program on a segment: a list of (mode, params, duration ms,
+# transition ms) steps, looped until the next select(). Steps change on
+# frame deadlines, and a step starts exactly where the previous one was due
+# to end, so a long show does not drift. A step with a transition fades in
+# from the one before: for that long the outgoing effect keeps rendering
+# into the segment's back buffer and the two are blended along the sine
+# easing curve. When both steps run the same effect object (the same mode)
+# the last frame of the outgoing step is copied into the back buffer before
+# the effect is re-initialised, and the fade starts from that still frame.
+# The back buffer is only allocated, once per segment, if a program has
+# transitions and the segment's budget has room for it; otherwise steps
+# cut. While only static effects are shown the render task sleeps until the
+# next step is due.
+
+import gc
+import time
+import uasyncio as asyncio
+import easing
+import kernels
+from frame_buffer import FrameBuffer
+from scheduler import FrameScheduler
+
+
+class Segment:
+    def __init__(self, strip, fb):
+        self.strip = strip  # Index of the strip the segment is on
+        self.fb = fb
+        self.effects = {}  # Mode -> effect object, created on first use
+        self.effect = None
+        self.mode = None
+        self.interval = 20
+        self.origin = 0  # ticks_ms of frame 0
+        self.t = 0
+        self.dirty = True  # Needs drawing whether or not t moved on
+        self.budget = None  # Bytes the effects may use, None for no limit
+        self.used = 0  # Bytes used by the effects created so far
+        self.refused = ()  # Modes whose effect never fits the budget
+        self.program = None  # Steps being played, see Renderer.play()
+        self.step = 0
+        self.step_end = 0  # ticks_ms at which the current step is due to end
+        self.back = None  # FrameBuffer the outgoing effect draws into
+        self.fading = False  # A transition is running
+        self.old = None  # Outgoing effect, or None to fade from the still frame in back
+        self.old_origin = 0
+        self.old_interval = 20
+        self.fade_start = 0
+        self.fade_ms = 0
+
+
+class Renderer:
+    def __init__(self, strips, segments, patterns):
+        self.strips = strips
+        self.segments = [Segment(i, fb) for i, fb in segments]
+        self.patterns = patterns
+        self.scheduler = FrameScheduler(strips)
+        self.dirty = bytearray(len(strips))  # Strips to write this frame
+        self.latency_ms = None  # Command to first frame of the last select(since)
+        self._since = None
+        self._changed = asyncio.ThreadSafeFlag()  # Set by select() and commit()
+
+    def plan(self, free):
+        total = sum(seg.fb.n for seg in self.segments)
+        for seg in self.segments:
+            fb = seg.fb
+            seg.budget = free * fb.n // total
+            seg.refused = [mode for mode, cls in self.patterns.items() if cls.state_bytes(fb.n, fb.bpp) > seg.budget]
+
+    def _effect(self, seg, mode, params):
+        # Make mode the segment's current effect
+        effect = seg.effects.get(mode)
+        if effect is None:
+            cls = self.patterns[mode]
+            need = cls.state_bytes(seg.fb.n, seg.fb.bpp)
+            back = seg.fb.size if seg.back is not None else 0
+            if seg.budget is not None and seg.used + need + back > seg.budget:
+                seg.effects = {}
+                seg.effect = None
+                seg.used = 0
+                gc.collect()
+            effect = seg.effects[mode] = cls(seg.fb)
+            seg.used += need
+        effect.init(params)
+        seg.effect = effect
+        seg.mode = mode
+        seg.interval = max(1, params.get("speed", 20))
+        seg.t = 0
+        seg.dirty = True
+
+    def _interval(self):
+        # Shortest interval among the segments that need frames
+        intervals = [s.interval for s in self.segments if s.fading or s.effect is not None and s.effect.animated]
+        return min(intervals) if intervals else None
+
+    def select(self, mode, params, since=None, segment=0):
+        seg = self.segments[segment]
+        seg.program = None
+        seg.fading = False
+        seg.old = None
+        self._effect(seg, mode, params)
+        self.scheduler.start(self._interval() or seg.interval)
+        seg.origin = self.scheduler.deadline
+        self._since = since
+        self.scheduler.wake = True
+        self._changed.set()
+
+    def play(self, program, since=None, segment=0):
+        seg = self.segments[segment]
+        fb = seg.fb
+        if seg.back is None and any(step[3] for step in program):
+            if seg.budget is None or seg.used + fb.size <= seg.budget:
+                seg.back = FrameBuffer(bytearray(fb.size), fb.n, fb.bpp, fb.order)
+        seg.program = program
+        seg.step = -1
+        seg.fading = False
+        seg.old = None
+        self._next_step(seg, time.ticks_ms())
+        self.scheduler.start(self._interval() or seg.interval)
+        self._since = since
+        self.scheduler.wake = True
+        self._changed.set()
+
+    def _next_step(self, seg, now):
+        # Start the step after the current one at ticks_ms now
+        program = seg.program
+        seg.step = (seg.step + 1) % len(program)
+        mode, params, duration, transition = program[seg.step]
+        old = seg.effect
+        seg.fading = bool(transition) and seg.back is not None and old is not None
+        seg.old = None
+        if seg.fading:
+            seg.fade_start = now
+            seg.fade_ms = transition
+            if old is seg.effects.get(mode):
+                seg.back.blit(seg.fb.buf)  # init() below changes old itself
+            else:
+                seg.old = old
+                seg.old_origin = seg.origin
+                seg.old_interval = seg.interval
+        self._effect(seg, mode, params)
+        seg.origin = now
+        seg.step_end = time.ticks_add(now, max(1, duration))
+
+    def _wake(self):
+        # ms until the next program step is due, or None if nothing is playing
+        wake = None
+        now = time.ticks_ms()
+        for seg in self.segments:
+            if seg.program is not None:
+                ms = max(0, time.ticks_diff(seg.step_end, now))
+                if wake is None or ms < wake:
+                    wake = ms
+        return wake
+
+    def commit(self, segment=0):
+        self.segments[segment].dirty = True
+        self.scheduler.wake = True
+        self._changed.set()
+
+    def render(self):
+        # Draw the segments that changed without latching them. Returns True
+        # if any segment is animated.
+        now = self.scheduler.deadline
+        animated = False
+        retime = False
+        for seg in self.segments:
+            if seg.program is not None and time.ticks_diff(now, seg.step_end) >= 0:
+                # Steps missed while the task slept are skipped, not rushed
+                while time.ticks_diff(now, seg.step_end) >= 0:
+                    self._next_step(seg, seg.step_end)
+                retime = True
+            effect = seg.effect
+            if seg.fading:
+                elapsed = time.ticks_diff(now, seg.fade_start)
+                if elapsed < seg.fade_ms:
+                    animated = True
+                    seg.t = time.ticks_diff(now, seg.origin) // seg.interval
+                    if seg.old is not None:
+                        seg.old.render(seg.back, time.ticks_diff(now, seg.old_origin) // seg.old_interval)
+                    effect.render(seg.fb, seg.t)
+                    w = easing.ease(easing.SINE, elapsed * easing.ONE // seg.fade_ms)
+                    kernels.blend(seg.fb.buf, seg.back.buf, seg.fb.size, w)
+                    seg.dirty = False
+                    self.dirty[seg.strip] = 1
+                    continue
+                seg.fading = False
+                seg.old = None
+                seg.dirty = True
+                retime = True
+            if effect is not None and effect.animated:
+                animated = True
+                t = time.ticks_diff(now, seg.origin) // seg.interval
+                if t == seg.t and not seg.dirty:
+                    continue
+                seg.t = t
+            elif not seg.dirty:
+                continue
+            seg.dirty = False
+            if effect is None:
+                seg.fb.clear()
+            else:
+                effect.render(seg.fb, seg.t)
+            self.dirty[seg.strip] = 1
+        if retime:
+            interval = self._interval()
+            if interval is not None and interval != self.scheduler.interval:
+                self.scheduler.interval = interval
+        return animated
+
+    async def run(self):
+        while True:
+            self._changed.clear()
+            self.scheduler.wake = False
+            self.scheduler.begin()
+            animated = self.render()
+            if self._since is not None:
+                self.latency_ms = time.ticks_diff(time.ticks_ms(), self._since)
+                self._since = None
+            if animated:
+                await self.scheduler.frame(self.dirty)
+                continue
+            self.scheduler.latch(self.dirty)
+            wake = self._wake()
+            if wake is None:
+                await self._changed.wait()
+            else:
+                try:
+                    await asyncio.wait_for_ms(self._changed.wait(), wake)
+                except asyncio.TimeoutError:
+                    pass
+            # Idle for a while: render the next frame as of now
+            self.scheduler.start(self.scheduler.interval)
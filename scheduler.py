@@ -0,0 +1,112 @@
+# scheduler.py Fixed-timestep frame pacing for the LED effects
+
+# Effects render a frame into the buffers and then await frame(), which
+# latches the strips flagged in dirty with one write() each and sleeps until
+# the next deadline. Deadlines advance by a fixed interval from the start of
+# the effect, so render and write time are absorbed into the interval instead
+# of being added to it. When a frame runs a whole interval or more late the
+# missed slots are dropped rather than rendered in a burst, and counted in
+# skipped. deadline is the ticks_ms of the slot being rendered; effects work
+# out their frame from it, so dropped slots do not slow animations down.
+#
+# begin() marks the start of rendering a frame and latch() writes it out; both
+# are timed into render_time and write_time for the stats command, and the
+# heap is sampled once per second alongside the frame rate.
+#
+# latch() keeps the CRC32 of what each strip was last written with and skips
+# the write() of a flagged strip whose buffer still has the same CRC: write()
+# holds off interrupts for the whole strip, and slow fades, finished wipes and
+# re-selected static modes often draw the very same pixels again. A checksum
+# costs one word per strip where a copy of the last frame would cost a whole
+# buffer. writes and unchanged count the write() calls made and skipped.
+
+from binascii import crc32
+import time
+import uasyncio as asyncio
+from telemetry import HeapWatch, Timing
+
+WAKE_SLICE_MS = 20  # Longest sleep in frame() between looks at wake
+
+
+class FrameScheduler:
+    def __init__(self, strips, interval=20):
+        self.strips = strips
+        self.render_time = Timing()  # us from begin() to latch()
+        self.write_time = Timing()  # us spent in write() per frame
+        self.heap = HeapWatch()
+        self.crc = [None] * len(strips)  # CRC32 of every strip's last write()
+        self.writes = 0
+        self.unchanged = 0
+        self.wake = False  # Set to end the wait in frame() early, see there
+        self._render_start = time.ticks_us()
+        self.start(interval)
+
+    def start(self, interval):
+        now = time.ticks_ms()
+        self.interval = max(1, interval)
+        self.deadline = now
+        self.frames = 0  # Frames written since start()
+        self.skipped = 0  # Frame slots dropped since start()
+        self.fps = 0  # Frames written during the last full second
+        self._window_start = now
+        self._window_frames = 0
+
+    def target_fps(self):
+        return 1000 // self.interval
+
+    def _count(self, now):
+        self.frames += 1
+        self._window_frames += 1
+        elapsed = time.ticks_diff(now, self._window_start)
+        if elapsed >= 1000:
+            self.fps = self._window_frames * 1000 // elapsed
+            self._window_start = now
+            self._window_frames = 0
+            self.heap.sample()
+
+    def begin(self):
+        self._render_start = time.ticks_us()
+
+    def latch(self, dirty):
+        # Write every strip whose dirty flag is set and whose pixels changed,
+        # and clear the flags
+        start = time.ticks_us()
+        self.render_time.add(time.ticks_diff(start, self._render_start))
+        for i in range(len(dirty)):
+            if dirty[i]:
+                dirty[i] = 0
+                strip = self.strips[i]
+                crc = crc32(strip.buf)
+                if crc == self.crc[i]:
+                    self.unchanged += 1
+                    continue
+                self.crc[i] = crc
+                strip.write()
+                self.writes += 1
+        self.write_time.add(time.ticks_diff(time.ticks_us(), start))
+
+    async def frame(self, dirty):
+        # Latch the rendered frame and wait for the slot of the next one.
+        # Setting wake (from a task or an IRQ; the caller clears it) ends the
+        # wait early, so a new effect does not sit out the rest of a slow
+        # one's interval. The wait is slept in slices of at most
+        # WAKE_SLICE_MS, with wake checked in between: unlike waiting on a
+        # ThreadSafeFlag with a timeout, sleep_ms() allocates nothing, and at
+        # the default 20 ms interval a frame still takes a single sleep.
+        self.latch(dirty)
+        now = time.ticks_ms()
+        self._count(now)
+
+        interval = self.interval
+        self.deadline = time.ticks_add(self.deadline, interval)
+        late = time.ticks_diff(time.ticks_ms(), self.deadline)
+        if late >= interval:
+            missed = late // interval
+            self.deadline = time.ticks_add(self.deadline, missed * interval)
+            self.skipped += missed
+
+        wait = time.ticks_diff(self.deadline, time.ticks_ms())
+        while wait > WAKE_SLICE_MS and not self.wake:
+            await asyncio.sleep_ms(WAKE_SLICE_MS)
+            wait = time.ticks_diff(self.deadline, time.ticks_ms())
+        await asyncio.sleep_ms(wait if wait > 0 and not self.wake else 0)
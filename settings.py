@@ -1,21 +1,386 @@
-import hashlib
-import json
+# hashlib, json and uasyncio are imported where they are used: boot reads
+# the saved settings through read_saved() before anything else and needs
+# none of them.
+
+import binascii
 import os
+import struct
+import time
+
+SETTINGS_FILE = "settings.bin"
+TEMP_FILE = "settings.tmp"
+LEGACY_FILE = "settings.json"  # Read if there is no binary record yet
+DEFAULT_SETTINGS = {"mode": "off", "color": "red", "brightness": 100, "speed": 20, "curve": "default"}
+FIELDS = ("mode", "color", "brightness", "speed", "curve")
+
+# Settings keeps the values as plain attributes and bumps generation whenever
+# set() actually changes one. digest() is only recomputed when the generation
+# moved on since the last call, and the digest (and values) last loaded from
+# or saved to flash are kept in memory, so change checks never touch the
+# file system and rarely hash anything.
+
+class Settings:
+    __slots__ = FIELDS + ("segment", "old_mode", "generation", "saved", "saved_digest", "_digest", "_digest_generation")
+
+    def __init__(self, values=DEFAULT_SETTINGS, segment=0):
+        self.segment = segment  # Strip segment these settings drive, see files()
+        self.old_mode = None  # Mode to restore after a command, never saved
+        self.generation = 0
+        self.saved = None  # Values as last loaded or saved
+        self.saved_digest = None
+        self._digest = None
+        self._digest_generation = -1
+        for name in FIELDS:
+            setattr(self, name, values.get(name, DEFAULT_SETTINGS[name]))
+
+    def set(self, name, value):
+        # Returns True if the value changed
+        if getattr(self, name) == value:
+            return False
+        setattr(self, name, value)
+        self.generation += 1
+        return True
+
+    def update(self, values):
+        changed = False
+        for name in FIELDS:
+            if self.set(name, values[name]):
+                changed = True
+        return changed
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in FIELDS}
+
+    def digest(self):
+        if self._digest_generation != self.generation:
+            self._digest = hash_settings(self.as_dict())
+            self._digest_generation = self.generation
+        return self._digest
+
+    def is_saved(self):
+        return self.digest() == self.saved_digest
 
-SETTINGS_FILE = "settings.json"
-DEFAULT_SETTINGS = {"mode": "off", "color": "red", "brightness": 100, "speed": 20}
+    def mark_saved(self):
+        self.saved = self.as_dict()
+        self.saved_digest = self.digest()
 
-def load_settings():
-    if SETTINGS_FILE in os.listdir():
-        with open(SETTINGS_FILE, 'r') as file:
+# On flash the settings are one binary record followed by the CRC32 of it:
+# the RECORD_HEADER fields, the mode name and, unless RECORD_RGB is set, the
+# colour name. The easing curve is kept in the flags, as an index into
+# CURVE_NAMES, so records written before it existed read as "default". A record is written to TEMP_FILE and renamed over
+# SETTINGS_FILE, so a power cut leaves either the old or the new one; loading
+# skips any record whose magic, version or CRC does not match. Segments after
+# the first keep their records in files of their own (see files()).
+RECORD_MAGIC = b"LS"
+RECORD_VERSION = 1
+RECORD_HEADER = "<2sBBHBBBBBB"  # magic, version, brightness, speed, flags, r, g, b, mode length, colour name length
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER)
+RECORD_RGB = 0x01  # The colour is r, g, b rather than a name
+RECORD_CURVE_SHIFT = 1  # Flags bits 1 to 3 hold the curve
+CURVE_NAMES = ("default", "linear", "sine", "quad", "cubic", "cie")  # "default" is the effect's own, see easing.CURVES
+
+def encode_record(values):
+    color = values["color"]
+    if isinstance(color, str):
+        flags, (r, g, b), name = 0, (0, 0, 0), color.encode()
+    else:
+        flags, (r, g, b), name = RECORD_RGB, color, b""
+    flags |= CURVE_NAMES.index(values["curve"]) << RECORD_CURVE_SHIFT
+    mode = values["mode"].encode()
+    record = struct.pack(RECORD_HEADER, RECORD_MAGIC, RECORD_VERSION, values["brightness"], values["speed"],
+                         flags, r, g, b, len(mode), len(name)) + mode + name
+    return record + struct.pack("<I", binascii.crc32(record))
+
+def decode_record(data):
+    # Returns the values in a record, or None if it is not a valid one
+    if len(data) < RECORD_HEADER_SIZE + 4:
+        return None
+    magic, version, brightness, speed, flags, r, g, b, mode_len, name_len = struct.unpack_from(RECORD_HEADER, data)
+    end = RECORD_HEADER_SIZE + mode_len + name_len
+    if magic != RECORD_MAGIC or version != RECORD_VERSION or len(data) != end + 4:
+        return None
+    if struct.unpack_from("<I", data, end)[0] != binascii.crc32(data[:end]):
+        return None
+    curve = flags >> RECORD_CURVE_SHIFT
+    if curve >= len(CURVE_NAMES):
+        return None
+    mode = data[RECORD_HEADER_SIZE:RECORD_HEADER_SIZE + mode_len].decode()
+    color = [r, g, b] if flags & RECORD_RGB else data[end - name_len:end].decode()
+    return {"mode": mode, "color": color, "brightness": brightness, "speed": speed, "curve": CURVE_NAMES[curve]}
+
+def read_record(path):
+    try:
+        with open(path, "rb") as file:
+            return decode_record(file.read())
+    except (OSError, UnicodeError):
+        return None
+
+_default_digest = None
+
+def default_digest():
+    global _default_digest
+    if _default_digest is None:
+        _default_digest = hash_settings(DEFAULT_SETTINGS)
+    return _default_digest
+
+def files(segment):
+    # Record and temp file of a segment's settings
+    if not segment:
+        return SETTINGS_FILE, TEMP_FILE
+    return "settings{}.bin".format(segment), "settings{}.tmp".format(segment)
+
+def read_saved(segment=0):
+    # Returns the saved values, or None if nothing valid was saved. A rename
+    # interrupted by a power cut can leave the newest record in the temp file
+    # only
+    for path in files(segment):
+        values = read_record(path)
+        if values is not None:
+            return values
+    if segment:
+        return None
+    try:
+        import json
+        with open(LEGACY_FILE, 'r') as file:
             return json.load(file)
-    return DEFAULT_SETTINGS
+    except (OSError, ValueError):
+        return None
+
+def load_settings(values=None, segment=0):
+    # values: what read_saved() returned, if it was already called
+    if values is None:
+        values = read_saved(segment)
+    if values is None:
+        return Settings(segment=segment)
+    settings = Settings(values, segment)
+    settings.mark_saved()
+    return settings
+
+def write_atomic(path, temp, data):
+    with open(temp, 'wb') as file:
+        file.write(data)
+    try:
+        os.rename(temp, path)
+    except OSError:
+        os.remove(path)  # File systems that do not rename over a file
+        os.rename(temp, path)
 
 def save_settings(settings):
-    with open(SETTINGS_FILE, 'w') as file:
-        json.dump(settings, file)
-        
+    # Returns False, without touching flash, if nothing changed since the
+    # settings were last loaded or saved
+    if settings.is_saved():
+        return False
+    path, temp = files(settings.segment)
+    write_atomic(path, temp, encode_record(settings.as_dict()))
+    settings.mark_saved()
+    if not settings.segment:
+        try:
+            os.remove(LEGACY_FILE)
+        except OSError:
+            pass
+    return True
+
+class SettingsStore:
+    # Writes the settings of every segment (a list of Settings; only the ones
+    # that changed touch flash) once things have been quiet for a while: debounce_ms
+    # after the last save() request, so a burst of requests costs one write
+    # (of the settings as they are by then), or, when autosave_s is set, that
+    # many seconds after the last changed() call. run() is the task that does
+    # it and calls on_saved(written, error) after every write, every requested
+    # save that found nothing to write and every failed write. A record whose
+    # write raised OSError (flash full, a file system error) is left unsaved,
+    # so the next flush tries it again, and error is that OSError, else None.
+    # A Program given as program is saved along with the settings.
+
+    def __init__(self, settings, on_saved=None, debounce_ms=1000, autosave_s=0, program=None):
+        self.settings = settings
+        self.program = program
+        self.on_saved = on_saved
+        self.debounce_ms = debounce_ms
+        self.autosave_ms = autosave_s * 1000
+        self.requested = False
+        self.changed_ms = 0
+        self.writes = 0  # Records written to flash
+        self.skipped = 0  # Saves that found nothing to write
+        self.failed = 0  # Records whose write raised OSError
+        import uasyncio as asyncio
+        self._event = asyncio.Event()
+
+    def save(self):
+        self.requested = True
+        self.changed_ms = time.ticks_ms()
+        self._event.set()
+
+    def changed(self):
+        if self.autosave_ms:
+            self.changed_ms = time.ticks_ms()
+            self._event.set()
+
+    def flush(self):
+        requested = self.requested
+        self.requested = False
+        written = False
+        error = None
+        records = [(save_settings, settings) for settings in self.settings]
+        if self.program is not None:
+            records.append((save_program, self.program))
+        for save, record in records:
+            try:
+                if save(record):
+                    self.writes += 1
+                    written = True
+            except OSError as e:
+                self.failed += 1
+                error = e
+        if not written and error is None:
+            self.skipped += 1
+        if self.on_saved is not None and (written or requested or error is not None):
+            self.on_saved(written, error)
+
+    async def run(self):
+        import uasyncio as asyncio
+        while True:
+            await self._event.wait()
+            while True:
+                delay = self.debounce_ms if self.requested else self.autosave_ms
+                wait = time.ticks_diff(time.ticks_add(self.changed_ms, delay), time.ticks_ms())
+                if wait <= 0:
+                    break
+                await asyncio.sleep_ms(wait)
+            self._event.clear()  # Requests made while waiting are covered
+            self.flush()
+
+# The strip layout (see strip.py) is a record of its own in LAYOUT_FILE,
+# written the same way as the settings: LAYOUT_HEADER, then LAYOUT_STRIP per
+# strip and LAYOUT_SEGMENT per segment, then the CRC32. It is only read at
+# boot, since the strip buffers are allocated once.
+LAYOUT_FILE = "layout.bin"
+LAYOUT_TEMP = "layout.tmp"
+LAYOUT_MAGIC = b"LL"
+LAYOUT_VERSION = 1
+LAYOUT_HEADER = "<2sBBB"  # magic, version, strips, segments
+LAYOUT_STRIP = "<BHB"  # pin, LEDs, index into ORDER_NAMES
+LAYOUT_SEGMENT = "<BHH"  # pin, first LED, LEDs
+ORDER_NAMES = ("grb", "rgb", "grbw", "rgbw")
+
+def encode_layout(strips, segments):
+    # strips: (pin, LEDs, order name) tuples, segments: (pin, first LED, LEDs)
+    record = struct.pack(LAYOUT_HEADER, LAYOUT_MAGIC, LAYOUT_VERSION, len(strips), len(segments))
+    for pin, n, order in strips:
+        record += struct.pack(LAYOUT_STRIP, pin, n, ORDER_NAMES.index(order))
+    for segment in segments:
+        record += struct.pack(LAYOUT_SEGMENT, *segment)
+    return record + struct.pack("<I", binascii.crc32(record))
+
+def decode_layout(data):
+    # Returns (strips, segments), or None if data is not a valid layout record
+    header = struct.calcsize(LAYOUT_HEADER)
+    strip_size = struct.calcsize(LAYOUT_STRIP)
+    segment_size = struct.calcsize(LAYOUT_SEGMENT)
+    if len(data) < header + 4:
+        return None
+    magic, version, n_strips, n_segments = struct.unpack_from(LAYOUT_HEADER, data)
+    end = header + n_strips * strip_size + n_segments * segment_size
+    if magic != LAYOUT_MAGIC or version != LAYOUT_VERSION or len(data) != end + 4:
+        return None
+    if struct.unpack_from("<I", data, end)[0] != binascii.crc32(data[:end]):
+        return None
+    strips = []
+    for i in range(n_strips):
+        pin, n, order = struct.unpack_from(LAYOUT_STRIP, data, header + i * strip_size)
+        if order >= len(ORDER_NAMES):
+            return None
+        strips.append((pin, n, ORDER_NAMES[order]))
+    offset = header + n_strips * strip_size
+    segments = [struct.unpack_from(LAYOUT_SEGMENT, data, offset + i * segment_size) for i in range(n_segments)]
+    return tuple(strips), tuple(segments)
+
+def read_layout():
+    try:
+        with open(LAYOUT_FILE, "rb") as file:
+            return decode_layout(file.read())
+    except OSError:
+        return None
+
+def save_layout(strips, segments):
+    write_atomic(LAYOUT_FILE, LAYOUT_TEMP, encode_layout(strips, segments))
+
+# The program played by the "play" mode is a list of steps, each the values
+# of a settings record shown for duration ms and faded into over transition
+# ms. On flash it follows the layout: PROGRAM_HEADER, then per step
+# PROGRAM_STEP and the step's settings record (see encode_record()), then the
+# CRC32 of all of it.
+PROGRAM_FILE = "program.bin"
+PROGRAM_TEMP = "program.tmp"
+PROGRAM_MAGIC = b"LP"
+PROGRAM_VERSION = 1
+PROGRAM_HEADER = "<2sBB"  # magic, version, steps
+PROGRAM_STEP = "<IHB"  # duration, transition, settings record length
+
+class Program:
+    __slots__ = ("steps", "saved")
+
+    def __init__(self, steps=()):
+        self.steps = list(steps)  # (values, duration, transition)
+        self.saved = True  # Same as on flash
+
+    def add(self, values, duration, transition):
+        self.steps.append((values, duration, transition))
+        self.saved = False
+
+    def clear(self):
+        self.steps = []
+        self.saved = False
+
+def encode_program(steps):
+    record = struct.pack(PROGRAM_HEADER, PROGRAM_MAGIC, PROGRAM_VERSION, len(steps))
+    for values, duration, transition in steps:
+        step = encode_record(values)
+        record += struct.pack(PROGRAM_STEP, duration, transition, len(step)) + step
+    return record + struct.pack("<I", binascii.crc32(record))
+
+def decode_program(data):
+    # Returns the steps, or None if data is not a valid program record
+    header = struct.calcsize(PROGRAM_HEADER)
+    step_size = struct.calcsize(PROGRAM_STEP)
+    if len(data) < header + 4:
+        return None
+    magic, version, count = struct.unpack_from(PROGRAM_HEADER, data)
+    if magic != PROGRAM_MAGIC or version != PROGRAM_VERSION:
+        return None
+    if struct.unpack_from("<I", data, len(data) - 4)[0] != binascii.crc32(data[:-4]):
+        return None
+    steps = []
+    offset = header
+    for _ in range(count):
+        duration, transition, size = struct.unpack_from(PROGRAM_STEP, data, offset)
+        offset += step_size
+        values = decode_record(data[offset:offset + size])
+        if values is None:
+            return None
+        steps.append((values, duration, transition))
+        offset += size
+    return steps if offset == len(data) - 4 else None
+
+def load_program():
+    try:
+        with open(PROGRAM_FILE, "rb") as file:
+            steps = decode_program(file.read())
+    except (OSError, UnicodeError):
+        steps = None
+    return Program(steps or ())
+
+def save_program(program):
+    # Returns False, without touching flash, if the program did not change
+    if program.saved:
+        return False
+    write_atomic(PROGRAM_FILE, PROGRAM_TEMP, encode_program(program.steps))
+    program.saved = True
+    return True
+
 def hash_settings(settings):
+    import hashlib
+    import json
     json_string = json.dumps(settings)
     sha1 = hashlib.sha1(json_string)
     return sha1.digest()
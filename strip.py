@@ -0,0 +1,107 @@
+# strip.py The NeoPixel strips and the segments drawn on them
+
+# Kept apart from the effects so that boot can light the strips with the saved
+# static modes (restore()) before led_patterns, BLE and the rest are imported.
+#
+# Every physical strip has one NeoPixel and one buffer. A segment is a run of
+# LEDs on one strip; its FrameBuffer is a view into that strip's buffer, so
+# segments never copy pixels and a strip is latched with a single write() no
+# matter how many segments it is split into. Segments are numbered in the
+# order of SEGMENTS; np, fb and NUM_LEDS are the first strip and segment.
+#
+# The layout saved by the "strip" command (settings.read_layout()) replaces
+# the built-in STRIPS and SEGMENTS. A saved layout that is malformed, or whose
+# buffers would leave less than HEAP_RESERVE bytes of heap, is refused at boot
+# and the built-in one is used instead, with the reason in layout_error. The
+# effects get what is left beyond HEAP_RESERVE (see Renderer.plan()).
+
+import gc
+from machine import Pin
+from neopixel import NeoPixel
+import palette
+from frame_buffer import FrameBuffer
+from settings import read_layout
+
+# Byte order of the pixels, by name: colour channels as offsets, then white
+ORDERS = {
+    "grb": (1, 0, 2),
+    "rgb": (0, 1, 2),
+    "grbw": (1, 0, 2, 3),
+    "rgbw": (0, 1, 2, 3),
+}
+
+# (pin, number of LEDs, order) per physical strip
+STRIPS = (
+    (2, 180, "grb"),
+)
+
+# (pin, first LED, number of LEDs) per segment
+SEGMENTS = (
+    (2, 0, 180),
+)
+
+HEAP_RESERVE = 32 * 1024  # Left for BLE, the palette tables and all else but effect buffers
+
+
+def pixel_bytes(strips):
+    return sum(n * len(ORDERS[order]) for _, n, order in strips)
+
+
+def check_layout(strips, segments, free):
+    # Returns why the layout cannot be used with free bytes of heap, or None
+    # if it can
+    pins = [pin for pin, _, _ in strips]
+    if not strips or not segments or len(set(pins)) != len(pins):
+        return "needs strips on distinct pins and at least one segment"
+    for pin, n, order in strips:
+        if not 0 <= pin < 256 or n <= 0 or order not in ORDERS:
+            return "strip on pin {} has no LEDs or an unknown order".format(pin)
+    for pin, start, n in segments:
+        if pin not in pins or start < 0 or n <= 0 or start + n > strips[pins.index(pin)][1]:
+            return "segment ({}, {}, {}) is not on a strip".format(pin, start, n)
+    need = pixel_bytes(strips)
+    if need + HEAP_RESERVE > free:
+        return "{} bytes of pixels leave less than {} bytes free".format(need, HEAP_RESERVE)
+    return None
+
+
+def _segment(pin, start, n):
+    i = [p for p, _, _ in STRIPS].index(pin)
+    bpp = strips[i].bpp
+    view = memoryview(strips[i].buf)[start * bpp:(start + n) * bpp]
+    return i, FrameBuffer(view, n, bpp, ORDERS[STRIPS[i][2]])
+
+
+layout_error = None  # Why the saved layout was refused, if it was
+saved_layout = read_layout()
+if saved_layout is not None:
+    gc.collect()
+    layout_error = check_layout(saved_layout[0], saved_layout[1], gc.mem_free())
+    if layout_error is None:
+        STRIPS, SEGMENTS = saved_layout
+del saved_layout
+
+strips = [NeoPixel(Pin(pin), n, bpp=len(ORDERS[order])) for pin, n, order in STRIPS]
+segments = [_segment(pin, start, n) for pin, start, n in SEGMENTS]  # (index into strips, FrameBuffer)
+
+np = strips[0]
+fb = segments[0][1]
+NUM_LEDS = STRIPS[0][1]
+NEOPIXEL_LEDS_PIN = STRIPS[0][0]
+
+
+def restore(values, segment=0):
+    # Show a saved "off", "on" or "color" mode; animated modes stay dark
+    # until their effect is running
+    mode = values["mode"]
+    color = values["color"]
+    if mode == "on":
+        color = palette.COLORS["white"]
+    elif mode != "color":
+        return
+    color = palette.COLORS.get(color) if isinstance(color, str) else color
+    if color is None:
+        return
+    i, fb = segments[segment]
+    fb.fill(fb.pack(palette.scale(color, values["brightness"])))
+    strips[i].write()
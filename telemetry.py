@@ -0,0 +1,50 @@
+# telemetry.py Fixed-size counters behind the stats command
+
+# Every counter is a handful of integer attributes on an object created once,
+# so recording a sample allocates nothing. Totals are halved together with
+# their counts before they could outgrow a small int.
+
+import gc
+
+
+class Timing:
+    # min/avg/max of a duration in microseconds since the last reset()
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.min = 0
+        self.max = 0
+        self.total = 0
+        self.count = 0
+
+    def add(self, us):
+        if not self.count or us < self.min:
+            self.min = us
+        if us > self.max:
+            self.max = us
+        self.total += us
+        self.count += 1
+        if self.count >= 65536:
+            self.total >>= 1
+            self.count >>= 1
+
+    def avg(self):
+        return self.total // self.count if self.count else 0
+
+    def format(self):
+        return "{}/{}/{}".format(self.min, self.avg(), self.max)
+
+
+class HeapWatch:
+    # MicroPython does not count garbage collections, so every drop in
+    # gc.mem_alloc() between two samples is counted as one (a lower bound)
+    def __init__(self):
+        self.collections = 0
+        self._alloc = gc.mem_alloc()
+
+    def sample(self):
+        alloc = gc.mem_alloc()
+        if alloc < self._alloc:
+            self.collections += 1
+        self._alloc = alloc
@@ -17,6 +17,9 @@ class ThreadSafeQueue:  # MicroPython optimised
         self._ri = 0
         self._evput = asyncio.ThreadSafeFlag()  # Triggered by put, tested by get
         self._evget = asyncio.ThreadSafeFlag()  # Triggered by get, tested by put
+        self.capacity = self._size - 1  # Most items it can hold, one slot is kept free
+        self.high = 0  # Most items ever queued at once
+        self.dropped = 0  # Non-blocking put_sync calls refused because full
 
     def full(self):
         return ((self._wi + 1) % self._size) == self._ri
@@ -38,13 +41,17 @@ class ThreadSafeQueue:  # MicroPython optimised
         return r
 
     def put_sync(self, v, block=False):
-        self._q[self._wi] = v
-        self._evput.set()  # Schedule task waiting on get
         if not block and self.full():
-            raise IndexError
+            self.dropped += 1
+            raise IndexError  # Drop without waking the consumer
         while self.full():
             pass  # can't bump ._wi until an item is removed
+        self._q[self._wi] = v
         self._wi = (self._wi + 1) % self._size
+        n = self.qsize()
+        if n > self.high:
+            self.high = n
+        self._evput.set()  # Schedule task waiting on get
 
     async def put(self, val):  # Usage: await queue.put(item)
         while self.full():  # Queue full